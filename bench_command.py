@@ -0,0 +1,100 @@
+import timeit
+
+from command import DispatchInstrumentation, Light, RemoteControl
+
+
+class QuietLight(Light):
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def make_remote_control():
+    remote_control_ = RemoteControl()
+    for slot in range(6):
+        light = QuietLight(location=f'Room {slot}')
+        remote_control_.set_command(slot, light.on, light.off)
+    return remote_control_
+
+
+def make_events(count):
+    return [(i % 6, bool(i % 2)) for i in range(count)]
+
+
+def bench_dispatch_many(count=10_000, repeat=5):
+    remote_control_ = make_remote_control()
+    events = make_events(count)
+
+    def per_event():
+        for slot, is_on in events:
+            if is_on:
+                remote_control_.push_on_button(slot)
+            else:
+                remote_control_.push_off_button(slot)
+
+    def batched():
+        remote_control_.dispatch_many(events)
+
+    per_event_time = min(timeit.repeat(per_event, number=1, repeat=repeat))
+    batched_time = min(timeit.repeat(batched, number=1, repeat=repeat))
+    print(f'{"per event":<14} {count} events {per_event_time * 1000:8.2f} ms')
+    print(f'{"dispatch_many":<14} {count} events {batched_time * 1000:8.2f} ms '
+          f'x{per_event_time / batched_time:.1f}')
+
+
+def bench_slot_registry(count=100_000, locations=1_000, repeat=5):
+    remote_control_ = RemoteControl(slots_count=0)
+
+    def build():
+        for i in range(count):
+            light = QuietLight(location=f'Room {i % locations}')
+            remote_control_.add_command(light.on, light.off)
+
+    build_time = timeit.timeit(build, number=1)
+    location = 'Room 7'
+
+    def by_index():
+        return remote_control_.slots.get_location_devices(location)
+
+    def by_scan():
+        return [d for slot in range(len(remote_control_.slots))
+                for d in remote_control_.slots.get_devices(slot) if d.location == location]
+
+    assert by_index() == by_scan()
+    index_time = min(timeit.repeat(by_index, number=1, repeat=repeat))
+    scan_time = min(timeit.repeat(by_scan, number=1, repeat=repeat))
+    push_time = min(timeit.repeat(lambda: remote_control_.push_on_button(count - 1), number=1000, repeat=repeat))
+    print(f'{"build":<14} {count} slots {build_time * 1000:8.2f} ms')
+    print(f'{"push":<14} {count} slots {push_time * 1000:8.2f} ms per 1000')
+    print(f'{"location scan":<14} {count} slots {scan_time * 1000:8.2f} ms')
+    print(f'{"location index":<14} {count} slots {index_time * 1000:8.2f} ms x{scan_time / index_time:.0f}')
+
+
+def bench_instrumentation(count=100_000, repeat=5):
+    remote_control_ = make_remote_control()
+
+    def push():
+        remote_control_.push_on_button(0)
+
+    def run():
+        return min(timeit.repeat(push, number=count, repeat=repeat)) / count * 1e9
+
+    check_time = min(timeit.repeat('remote_control_.instrumentation is not None', number=count, repeat=repeat,
+                                   globals={'remote_control_': remote_control_})) / count * 1e9
+    disabled_time = run()
+    remote_control_.instrumentation = DispatchInstrumentation()
+    enabled_time = run()
+    remote_control_.instrumentation = DispatchInstrumentation(tracer=lambda slot, command, elapsed_ns: None)
+    tracing_time = run()
+    print(f'{"disabled":<14} {disabled_time:8.0f} ns per push, check {check_time:.0f} ns '
+          f'({check_time / disabled_time:.1%})')
+    print(f'{"enabled":<14} {enabled_time:8.0f} ns per push')
+    print(f'{"tracing":<14} {tracing_time:8.0f} ns per push')
+
+
+if __name__ == '__main__':
+    bench_dispatch_many()
+    bench_slot_registry()
+    bench_instrumentation()
@@ -0,0 +1,159 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import timeit
+
+import decorator
+from decorator import (MENU, SIZES, Beverage, BeverageValue, BulkPricer, Espresso, Mocha, Size, Soy, Whip,
+                       format_order, parse_order, price_orders_file, render_line)
+
+
+class RecursiveCondiment(Beverage):
+    """Добавка-обёртка, которая считает цену и описание рекурсией по цепочке"""
+
+    def __init__(self, beverage_: Beverage, condiment):
+        self._beverage = beverage_
+        self._name = condiment._name
+        self._price = condiment._price
+
+    def cost(self):
+        return round(self._price + self._beverage.cost(), 2)
+
+    def get_desc(self):
+        return self._beverage.get_desc() + f', {self._name}'
+
+    def get_size(self):
+        return self._beverage.get_size()
+
+
+def make_chain(depth, condiment_type=None):
+    condiments = (Mocha, Soy, Whip)
+    coffe = Espresso()
+    beverage = coffe
+    for i in range(depth):
+        condiment = condiments[i % len(condiments)]
+        beverage = condiment(beverage) if condiment_type is None else condiment_type(beverage, condiment)
+    return coffe, beverage
+
+
+def bench_chain_depth(depths=(1, 10, 100, 1000), number=1000):
+    """Запрос цены и описания напитка с depth добавками: плоский BeverageOrder против рекурсивной цепочки"""
+    print(f'recursion limit {sys.getrecursionlimit()}')
+    for depth in depths:
+        coffe, beverage = make_chain(depth)
+        cached = timeit.timeit(lambda: (beverage.cost(), beverage.get_desc()), number=number) / number
+
+        def resized():
+            coffe.set_size(Size.L if coffe.get_size() == Size.M else Size.M)
+            return beverage.cost(), beverage.get_desc()
+
+        uncached = timeit.timeit(resized, number=number) / number
+
+        coffe.set_size(Size.M)
+        _, recursive = make_chain(depth, RecursiveCondiment)
+        try:
+            assert (recursive.cost(), recursive.get_desc()) == (beverage.cost(), beverage.get_desc())
+            elapsed = timeit.timeit(lambda: (recursive.cost(), recursive.get_desc()), number=number) / number
+            recursive_time = f'{elapsed * 1e6:10.2f} us'
+        except RecursionError:
+            recursive_time = f'{"RecursionError":>13}'
+        print(f'depth {depth:>5}: flat cached {cached * 1e6:8.2f} us, after set_size {uncached * 1e6:8.2f} us, '
+              f'recursive {recursive_time}')
+
+
+def make_orders(count, max_condiments=5, seed=1):
+    random.seed(seed)
+    pricer = BulkPricer.from_menu()
+    orders = []
+    for _ in range(count):
+        beverage = random.choice(pricer.bases)()
+        beverage.set_size(random.choice(SIZES))
+        for _ in range(random.randrange(max_condiments + 1)):
+            beverage = random.choice(pricer.condiments)(beverage)
+        orders.append(beverage)
+    return orders
+
+
+def bench_bulk_pricing(count=200_000):
+    """Цены пачки заказов: cost() каждого объекта против BulkPricer по колонкам"""
+    orders = make_orders(count)
+    pricer = BulkPricer.from_menu()
+
+    started = time.perf_counter()
+    costs = [order.cost() for order in orders]
+    object_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = pricer.encode(orders)
+    encode_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    prices = pricer.price(*columns)
+    price_time = time.perf_counter() - started
+    assert list(prices) == costs
+
+    bulk_name = 'bulk numpy' if decorator.np is not None else 'bulk array'
+    print(f'{"cost()":<11} {count / object_time:12,.0f} orders/s')
+    print(f'{bulk_name:<11} {count / price_time:12,.0f} orders/s x{object_time / price_time:.1f} '
+          f'(encode from objects {count / encode_time:,.0f} orders/s)')
+
+
+def bench_render_orders(count=100_000, popular=50):
+    """Строки чека для потока заказов из popular популярных: MENU против get_desc/cost/get_size у объекта"""
+    orders = make_orders(popular, seed=2)
+    random.seed(3)
+    stream = [random.choice(orders) for _ in range(count)]
+
+    def render_objects():
+        for order in stream:
+            render_line(order.get_desc(), order.cost(), order.get_size())
+
+    def render_menu():
+        for order in stream:
+            str(order)
+
+    object_time = timeit.timeit(render_objects, number=1)
+    menu_time = timeit.timeit(render_menu, number=1)
+    print(f'render objects {count / object_time:12,.0f} orders/s')
+    print(f'render MENU    {count / menu_time:12,.0f} orders/s x{object_time / menu_time:.1f} {MENU.cache_info()}')
+
+
+def bench_price_orders_file(count=1_000_000, chunk_sizes=(1000, 10_000, 100_000), workers=(1, 2, 4)):
+    """Конвейер цен по файлу заказов против разбора и цепочки обёрток для каждого заказа в одном процессе"""
+    print(f'cpu count {os.cpu_count()}')
+    orders = [format_order(BeverageValue.from_beverage(order)) for order in make_orders(10_000, seed=4)]
+    random.seed(5)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = os.path.join(tmp_dir, 'orders.txt')
+        dst = os.path.join(tmp_dir, 'prices.txt')
+        with open(src, 'w') as f:
+            for _ in range(count // len(orders)):
+                f.write('\n'.join(random.sample(orders, len(orders))) + '\n')
+
+        started = time.perf_counter()
+        with open(src) as f, open(dst, 'w') as prices:
+            for line in f:
+                prices.write(f'{parse_order(line).to_beverage().cost()}\n')
+        object_time = time.perf_counter() - started
+        with open(dst) as f:
+            expected = f.read()
+        print(f'{"objects":<24} {count / object_time:12,.0f} orders/s')
+
+        for workers_count in workers:
+            for chunk_size in chunk_sizes:
+                started = time.perf_counter()
+                assert price_orders_file(src, dst, chunk_size=chunk_size, workers=workers_count) == count
+                elapsed = time.perf_counter() - started
+                with open(dst) as f:
+                    assert f.read() == expected
+                print(f'{f"workers={workers_count} chunk={chunk_size}":<24} {count / elapsed:12,.0f} orders/s '
+                      f'x{object_time / elapsed:.1f}')
+
+
+if __name__ == '__main__':
+    bench_chain_depth()
+    bench_bulk_pricing()
+    bench_render_orders()
+    bench_price_orders_file()
@@ -0,0 +1,239 @@
+import asyncio
+import os
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import observer
+from observer import (BufferedSink, NotifyInstrumentation, ObserverInterface, PrintSink, RingStatisticSubscriber,
+                      RusScreenDisplay, ScreenAvgDisplay, ScreenDisplay, SharedReadingRing, WeatherStation,
+                      run_ring_subscriber)
+
+
+class LatencyObserver(ObserverInterface):
+
+    def __init__(self, subject, latency, is_failing=False):
+        super().__init__(subject)
+        self.latency = latency
+        self.is_failing = is_failing
+
+    def update(self, data: dict = None):
+        pass
+
+    async def aupdate(self, data: dict = None):
+        await asyncio.sleep(self.latency)
+        if self.is_failing:
+            raise RuntimeError('display is broken')
+
+
+class SyncLatencyObserver(ObserverInterface):
+    """Обычный дисплей: update блокирует поток пула станции"""
+
+    def __init__(self, subject, latency):
+        super().__init__(subject)
+        self.latency = latency
+
+    def update(self, data: dict = None):
+        time.sleep(self.latency)
+
+
+def bench_anotify_observers(count=10_000, timeout=.5, limit=None, sync_every=20, seed=1):
+    """Каждый sync_every наблюдатель - обычный дисплей, остальные асинхронные"""
+    random.seed(seed)
+    weather_station_ = WeatherStation()
+    latencies = []
+    observers_ = []
+    for i in range(count):
+        if not i % sync_every:
+            latency = random.choice((0, .0001, .001)) * random.random()
+            observers_.append(SyncLatencyObserver(weather_station_, latency))
+        else:
+            latency = random.choice((0, .001, .01, .1, 1.)) * random.random()
+            observers_.append(LatencyObserver(weather_station_, latency, is_failing=i % 1000 == 1))
+        latencies.append(latency)
+
+    weather_station_.set_changed()
+    started = time.perf_counter()
+    failures = asyncio.run(weather_station_.anotify_observers(data={'TEMP': 15, 'HUMIDITY': 25},
+                                                              timeout=timeout, limit=limit))
+    elapsed = time.perf_counter() - started
+    weather_station_.close()
+    timeouts = sum(isinstance(e, TimeoutError) for e in failures.values())
+    print(f'{count} observers ({count // sync_every} sync) limit={limit}: {elapsed:.2f} s '
+          f'(sequential {sum(min(latency, timeout) for latency in latencies):.0f} s), '
+          f'{timeouts} timeouts, {len(failures) - timeouts} errors')
+
+
+class CountingObserver(ObserverInterface):
+    count = 0
+
+    def update(self, data: dict = None):
+        self.count += 1
+
+    def update_batch(self, readings: list[dict]):
+        self.count += len(readings)
+
+
+def make_readings(sensors, rounds, changed_ratio, seed=1):
+    """Каждый датчик присылает одно показание за раунд"""
+    random.seed(seed)
+    sensor_ids = array('l')
+    for _ in range(rounds):
+        ids = list(range(sensors))
+        random.shuffle(ids)
+        sensor_ids.extend(ids)
+    count = len(sensor_ids)
+    temps = array('d', (20. if random.random() > changed_ratio else random.uniform(-30, 40) for _ in range(count)))
+    humiditys = array('d', [50.]) * count
+    timestamps = array('d', range(count))
+    return sensor_ids, temps, humiditys, timestamps
+
+
+def bench_weather_batch(sensors=10_000, rounds=100, changed_ratio=.1):
+    columns = make_readings(sensors, rounds, changed_ratio)
+    count = len(columns[0])
+
+    def run(is_batch):
+        weather_station_ = WeatherStation()
+        counter = CountingObserver(weather_station_)
+        warmup = array('l', range(sensors))
+        weather_station_.set_weather_batch(warmup, array('d', [20.]) * sensors, array('d', [50.]) * sensors,
+                                           array('d', [0.]) * sensors)
+        counter.count = 0
+        started = time.perf_counter()
+        if is_batch:
+            for start in range(0, count, sensors):
+                weather_station_.set_weather_batch(*(column[start:start + sensors] for column in columns))
+        else:
+            for reading in zip(*columns):
+                weather_station_.set_sensor_data(*reading)
+        elapsed = time.perf_counter() - started
+        return elapsed, counter.count
+
+    reading_time, reading_changes = run(is_batch=False)
+    batch_time, batch_changes = run(is_batch=True)
+    assert reading_changes == batch_changes
+    print(f'{"per reading":<12} {count / reading_time:12,.0f} readings/s, {reading_changes} changed')
+    batch_name = 'batch numpy' if observer.np is not None else 'batch array'
+    print(f'{batch_name:<12} {count / batch_time:12,.0f} readings/s x{reading_time / batch_time:.1f}')
+
+
+def bench_shared_ring(readings=200_000, subscribers=(1, 2, 4), window_size=1000):
+    """Одинаковые CPU-нагруженные подписчики: все в процессе станции против своих процессов на SharedReadingRing"""
+    print(f'cpu count {os.cpu_count()}')
+    random.seed(1)
+    columns = [(random.randrange(100), random.uniform(-30, 40), random.uniform(0, 100), float(i))
+               for i in range(readings)]
+    for count in subscribers:
+        handlers = [RingStatisticSubscriber(window_size) for _ in range(count)]
+        started = time.perf_counter()
+        for reading in columns:
+            for handler in handlers:
+                handler(*reading)
+        in_process_time = time.perf_counter() - started
+
+        ring = SharedReadingRing(capacity=readings)
+        weather_station_ = WeatherStation()
+        weather_station_.shared_ring = ring
+        with ProcessPoolExecutor(count) as executor:
+            executor.submit(time.sleep, 0).result()
+            started = time.perf_counter()
+            futures = [executor.submit(run_ring_subscriber, ring.name, readings, RingStatisticSubscriber(window_size))
+                       for _ in range(count)]
+            for reading in columns:
+                weather_station_.set_sensor_data(*reading)
+            ring.close()
+            results = [future.result() for future in futures]
+            ring_time = time.perf_counter() - started
+        ring.unlink()
+        assert all(handler.count == readings and not lost for handler, lost in results)
+        print(f'{count} subscribers in process {readings * count / in_process_time:12,.0f} deliveries/s, '
+              f'shared ring {readings * count / ring_time:12,.0f} deliveries/s x{in_process_time / ring_time:.1f}')
+
+
+class SlowObserver(ObserverInterface):
+
+    def __init__(self, subject, latency):
+        super().__init__(subject)
+        self.latency = latency
+
+    def update(self, data: dict = None):
+        time.sleep(self.latency)
+
+
+def bench_notify_instrumentation(observers=100, cycles=20_000):
+    """
+    notify_observers без инструментации против того же цикла оповещения вручную,
+    с инструментацией, и перевод медленного наблюдателя в фоновую очередь
+    """
+
+    def run(instrumentation=None, is_inline=False):
+        weather_station_ = WeatherStation()
+        weather_station_.instrumentation = instrumentation
+        observers_ = [CountingObserver(weather_station_) for _ in range(observers)]
+        started = time.perf_counter()
+        for temp in range(cycles):
+            data = {'TEMP': temp, 'HUMIDITY': 50}
+            weather_station_.set_changed()
+            if is_inline:
+                weather_station_.set_weather_data(temp=temp, humidity=50)
+                for observer_ in weather_station_._pop_changed_observers(data):
+                    observer_.update(data=data)
+            else:
+                weather_station_.notify_observers(data=data)
+        elapsed = time.perf_counter() - started
+        assert all(o.count == cycles for o in observers_)
+        return elapsed / cycles * 1e6
+
+    run()
+    inline = min(run(is_inline=True) for _ in range(5))
+    disabled = min(run() for _ in range(5))
+    enabled = min(run(NotifyInstrumentation()) for _ in range(3))
+    print(f'{observers} observers: inline {inline:.1f} us/cycle, disabled {disabled:.1f} us/cycle '
+          f'({(disabled / inline - 1) * 100:+.1f}%), enabled {enabled:.1f} us/cycle ({(enabled / inline - 1) * 100:+.0f}%)')
+
+    weather_station_ = WeatherStation()
+    instrumentation = weather_station_.instrumentation = NotifyInstrumentation(slow_threshold_ns=10 ** 6, demote=True)
+    observers_ = [CountingObserver(weather_station_) for _ in range(observers)]
+    slow_observer = SlowObserver(weather_station_, .002)
+    started = time.perf_counter()
+    for temp in range(1000):
+        weather_station_.set_changed()
+        weather_station_.notify_observers(data={'TEMP': temp, 'HUMIDITY': 50})
+    elapsed = time.perf_counter() - started
+    instrumentation.close()
+    snapshot = instrumentation.as_dict()
+    assert snapshot['demoted'] == [slow_observer] and all(o.count == 1000 for o in observers_)
+    print(f'slow observer demoted: 1000 cycles in {elapsed:.2f} s (inline {1000 * slow_observer.latency:.0f} s), '
+          f'slow observer p99 {snapshot["observers"][slow_observer]["p99"] / 1e6:.1f} ms, '
+          f'cycle p99 {snapshot["cycles"]["p99"] / 1e3:.0f} us')
+
+
+def bench_render(displays=1000, ticks=200):
+    """Дисплеи пишут в построчно буферизованный файл, как в терминал: print на каждый дисплей против одной записи"""
+    random.seed(1)
+    weather = [(random.randrange(-5, 5), random.randrange(40, 60)) for _ in range(ticks)]
+    with open(os.devnull, 'w', buffering=1) as stream:
+        for sink in (PrintSink(stream), BufferedSink(stream)):
+            weather_station_ = WeatherStation()
+            weather_station_.sink = sink
+            display_types = (ScreenDisplay, RusScreenDisplay, ScreenAvgDisplay)
+            displays_ = [display_types[i % len(display_types)](weather_station_) for i in range(displays)]
+            started = time.perf_counter()
+            for temp, humidity in weather:
+                weather_station_.set_changed()
+                weather_station_.notify_observers(data={'TEMP': temp, 'HUMIDITY': humidity})
+            elapsed = time.perf_counter() - started
+            print(f'{sink.__class__.__name__:<12} {displays} displays: {elapsed / ticks * 1e3:.2f} ms/tick, '
+                  f'{len(displays_) * ticks / elapsed:,.0f} lines/s')
+    print(ScreenDisplay.render.cache_info())
+
+
+if __name__ == '__main__':
+    bench_anotify_observers()
+    bench_anotify_observers(limit=1000)
+    bench_weather_batch()
+    bench_shared_ring()
+    bench_notify_instrumentation()
+    bench_render()
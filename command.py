@@ -2,10 +2,29 @@
 Есть пульт для устройств, где есть 2 кнопки для каждого устройства on\off.
 Требуется реализовать интерфейс для пульта с возможностью добавления устройств
 """
-import queue
+import asyncio
+import bisect
+import functools
+import inspect
+import itertools
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import tomllib
+import weakref
+import zlib
 from abc import ABC
+from array import array
+from collections import deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
 from typing import Callable
 
+from metrics import LatencyHistogram
+
 
 class CommandInterface:
 
@@ -33,18 +52,32 @@ class NoCommand(CommandInterface):
 
 
 class DeviceInterface:
+    is_on: bool
+
     def __init__(self, location):
         self.location = location
+        self.is_on = False
 
     def __str__(self):
         return f'{self.location} {self.__class__.__name__}'
 
     def on(self):
+        self.is_on = True
         print(f'{self} is on.')
 
     def off(self):
+        self.is_on = False
         print(f'{self} is off.')
 
+    def get_state(self) -> int:
+        return int(self.is_on)
+
+    def set_state(self, state: int):
+        if state:
+            self.on()
+        else:
+            self.off()
+
 
 class Light(DeviceInterface):
     ...
@@ -99,27 +132,46 @@ class CeilingFan(DeviceInterface):
     def get_speed(self):
         return self.speed
 
+    def get_state(self) -> int:
+        return self.speed
+
+    def set_state(self, state: int):
+        match state:
+            case self.HIGH:
+                self.high()
+            case self.MEDIUM:
+                self.medium()
+            case self.LOW:
+                self.low()
+            case self.OFF:
+                self.off()
+
+
+class SnapshotCommand(CommandInterface):
+    """
+    Команда, которая перед выполнением запоминает состояния своих устройств в DeviceSnapshot.
+    undo возвращает устройства к состоянию до последнего выполнения этой команды.
+    RemoteControl отменяет нажатия по своей истории и состояние команды не использует.
+    """
+    snapshot: 'DeviceSnapshot | None' = None
+
+    def capture(self):
+        self.snapshot = DeviceSnapshot()
+        self.snapshot.capture(self)
+
+    def undo(self):
+        if self.snapshot is not None:
+            self.snapshot.restore_command(self)()
+
 
-class BaseCeilingFanCommand(CommandInterface):
-    prev_speed: int
+class BaseCeilingFanCommand(SnapshotCommand):
 
     def __init__(self, device: 'CeilingFan' = None):
         super().__init__()
         self.device = device
 
     def __call__(self, *args, **kwargs):
-        self.prev_speed = self.device.get_speed()
-
-    def undo(self):
-        match self.prev_speed:
-            case self.device.HIGH:
-                self.device.high()
-            case self.device.MEDIUM:
-                self.device.medium()
-            case self.device.LOW:
-                self.device.low()
-            case self.device.OFF:
-                self.device.off()
+        self.capture()
 
 
 class CeilingFanHighCommand(BaseCeilingFanCommand):
@@ -149,18 +201,116 @@ class CeilingFanOffCommand(BaseCeilingFanCommand):
         self.device.off()
 
 
-class MacroCommand(CommandInterface):
+class MacroCommand(SnapshotCommand):
+    """
+    Выполняет команды по очереди. undo возвращает устройства к состоянию до последнего выполнения макроса,
+    команды без устройств отменяются в обратном порядке через undo_command.
+    """
     commands: list[CommandInterface]
 
     def __init__(self, commands):
         self.commands = commands
 
     def __call__(self, *args, **kwargs):
+        self.capture()
         for c in self.commands:
             c()
 
-    def undo(self):
-        pass
+
+_inverses: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _get_inverse_key(command: Callable) -> tuple:
+    """Для метода ключ - его объект, чтобы реестр не удерживал устройства"""
+    if inspect.ismethod(command):
+        return command.__self__, command.__func__
+    return command, None
+
+
+def register_inverse(command: Callable, inverse: Callable, symmetric: bool = True):
+    """
+    Обратное действие для обычных функций, например kitchen_light.on -> kitchen_light.off
+    Реестр держит устройства по слабым ссылкам и забывает их обратные действия вместе с ними.
+    """
+    owner, func = _get_inverse_key(command)
+    _inverses.setdefault(owner, {})[func] = weakref.WeakMethod(inverse) if inspect.ismethod(inverse) else inverse
+    if symmetric:
+        register_inverse(inverse, command, symmetric=False)
+
+
+def get_inverse(command: Callable) -> Callable | None:
+    owner, func = _get_inverse_key(command)
+    inverse = _inverses.get(owner, {}).get(func)
+    if isinstance(inverse, weakref.WeakMethod):
+        inverse = inverse()
+    return inverse
+
+
+def undo_command(command: CommandInterface | Callable):
+    if isinstance(command, CommandInterface):
+        return command.undo()
+    if (inverse := get_inverse(command)) is None:
+        raise ValueError(f'Inverse for {command} is not registered')
+    return inverse()
+
+
+class AsyncCommandInterface(CommandInterface):
+
+    async def __call__(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def undo(self):
+        raise NotImplementedError
+
+
+def is_async_command(command: CommandInterface | Callable) -> bool:
+    return isinstance(command, AsyncCommandInterface) or inspect.iscoroutinefunction(command)
+
+
+async def run_command(command: CommandInterface | Callable, *args, **kwargs):
+    """
+    Выполняет и обычные, и асинхронные команды.
+    Обычные команды выполняются в потоке через asyncio.to_thread, чтобы не блокировать цикл событий.
+    """
+    if is_async_command(command):
+        return await command(*args, **kwargs)
+    result = await asyncio.to_thread(command, *args, **kwargs)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+class AsyncMacroCommand(AsyncCommandInterface):
+    """
+    Запускает независимые команды одновременно.
+    limit - сколько команд может выполняться в один момент, None - без ограничений.
+    """
+    commands: list[CommandInterface | Callable]
+
+    def __init__(self, commands, limit: int = None):
+        if limit is not None and limit < 1:
+            raise ValueError('Concurrency limit must be positive')
+        self.commands = commands
+        self.limit = limit
+
+    async def __call__(self, *args, **kwargs):
+        await self._gather(self.commands)
+
+    async def undo(self):
+        await self._gather([functools.partial(undo_command, c) for c in self.commands])
+
+    async def _gather(self, commands):
+        if self.limit is None:
+            await asyncio.gather(*(run_command(c) for c in commands))
+            return
+
+        semaphore = asyncio.Semaphore(self.limit)
+
+        async def run_limited(command):
+            async with semaphore:
+                await run_command(command)
+
+        await asyncio.gather(*(run_limited(c) for c in commands))
 
 
 class Stereo(DeviceInterface):
@@ -195,50 +345,1172 @@ class StereoOffCommand(BaseCommand):
         self.device.on()
 
 
-class RemoteControl:
-    _slots_count = 6
-    _on_commands: dict[int, CommandInterface] = {}
-    _off_commands: dict[int, CommandInterface] = {}
-    undo_queue = queue.LifoQueue()
+def get_device(command: CommandInterface | Callable) -> DeviceInterface | None:
+    if isinstance(device := getattr(command, 'device', None), DeviceInterface):
+        return device
+    if isinstance(device := getattr(command, '__self__', None), DeviceInterface):
+        return device
+
+
+def get_leaf_commands(command: CommandInterface | Callable) -> list[CommandInterface | Callable]:
+    if isinstance(command, (MacroCommand, AsyncMacroCommand)):
+        return [leaf for c in command.commands for leaf in get_leaf_commands(c)]
+    return [command]
+
+
+def get_devices(command: CommandInterface | Callable) -> tuple[DeviceInterface, ...]:
+    if isinstance(command, (MacroCommand, AsyncMacroCommand)):
+        return tuple(dict.fromkeys(d for c in command.commands for d in get_devices(c)))
+    if (device := get_device(command)) is not None:
+        return device,
+    return ()
+
+
+class SetStateCommand(BaseCommand):
+    state: int
+
+    def __init__(self, device: DeviceInterface = None, state: int = 0):
+        super().__init__(device)
+        self.state = state
+
+    def __call__(self, *args, **kwargs):
+        if self.device.get_state() != self.state:
+            self.device.set_state(self.state)
+
+
+class SnapshotStateCommand(BaseCommand):
+    """
+    Возвращает устройство к состоянию из snapshot, прочитанному в момент выполнения.
+    Нужна, когда snapshot заполняет команда, ещё стоящая в очереди устройства перед этой.
+    """
+    snapshot: 'DeviceSnapshot'
+
+    def __init__(self, device: DeviceInterface = None, snapshot: 'DeviceSnapshot' = None):
+        super().__init__(device)
+        self.snapshot = snapshot
+
+    def __call__(self, *args, **kwargs):
+        state = self.snapshot.states.get(self.device)
+        if state is not None and self.device.get_state() != state:
+            self.device.set_state(state)
+
+
+class DeviceSnapshot:
+    """
+    Состояния устройств до выполнения команды.
+    Запоминаются только устройства, которых касается команда, поэтому и восстановление
+    затрагивает только их.
+    """
+    __slots__ = ('states',)
+    states: dict[DeviceInterface, int]
 
     def __init__(self):
-        for slot in range(self._slots_count):
-            self._on_commands[slot] = NoCommand()
-            self._off_commands[slot] = NoCommand()
-        self.undo_queue.put(NoCommand())
-        self.is_undo_set = False
+        self.states = {}
+
+    def __len__(self):
+        return len(self.states)
+
+    def capture(self, command: CommandInterface | Callable):
+        for device in get_devices(command):
+            if device not in self.states:
+                self.states[device] = device.get_state()
+
+    def restore_command(self, command: CommandInterface | Callable = None) -> 'MacroCommand':
+        """
+        Команда, которая возвращает устройства к запомненным состояниям.
+        command - что отменяется: его команды без устройств отменяются в обратном порядке через undo_command.
+        """
+        commands = [SetStateCommand(device, state) for device, state in reversed(self.states.items())]
+        if command is not None:
+            commands += [functools.partial(undo_command, c)
+                         for c in reversed(get_leaf_commands(command)) if get_device(c) is None]
+        return MacroCommand(commands)
+
+
+def get_restore_command(entries: list[tuple]) -> 'MacroCommand':
+    """
+    Команда отмены нажатия из записей CommandLog.pop: устройства возвращаются к состояниям до нажатия,
+    команды без устройств отменяются в обратном порядке через undo_command.
+    Если запись ещё ждёт fill, состояние читается из её snapshot уже в очереди устройства.
+    """
+    states = {}
+    for _, _, _, prev_states, snapshot in entries:
+        for device, prev_state in prev_states:
+            states.setdefault(device, snapshot if snapshot is not None else prev_state)
+    commands = [SnapshotStateCommand(device, state) if isinstance(state, DeviceSnapshot)
+                else SetStateCommand(device, state)
+                for device, state in reversed(states.items())]
+    for command, _, _, _, _ in reversed(entries):
+        commands += [functools.partial(undo_command, c)
+                     for c in reversed(get_leaf_commands(command)) if get_device(c) is None]
+    return MacroCommand(commands)
+
+
+def gather_futures(futures: list[Future]) -> Future:
+    """Future, которая завершается, когда завершены все futures"""
+    future = Future()
+    if not futures:
+        future.set_result(None)
+        return future
+
+    left = len(futures)
+    is_set = False
+    lock = threading.Lock()
+
+    def on_done(child: Future):
+        nonlocal left, is_set
+        exception = CancelledError() if child.cancelled() else child.exception()
+        with lock:
+            left -= 1
+            if is_set or (exception is None and left):
+                return
+            is_set = True
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(None)
+
+    for child_future in futures:
+        child_future.add_done_callback(on_done)
+    return future
+
+
+class DeviceExecutor:
+    """
+    Выполняет команды в пуле потоков.
+    Команды разных устройств идут параллельно, команды одного устройства - строго по очереди.
+    """
+    _lanes: dict[object, deque[tuple[Callable, Callable | None, Future]]]
+
+    def __init__(self, max_workers: int = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='device')
+        self._lock = threading.Lock()
+        self._lanes = {}
+        self.submitted = 0
+        self.completed = 0
+
+    def submit(self, command: CommandInterface | Callable, before: Callable = None) -> Future:
+        """before(command) вызывается в очереди устройства непосредственно перед командой"""
+        if isinstance(command, MacroCommand):
+            return self._submit_macro(command, before)
+
+        future = Future()
+        key = get_device(command) or command
+        with self._lock:
+            self.submitted += 1
+            if (lane := self._lanes.get(key)) is not None:
+                lane.append((command, before, future))
+                return future
+            self._lanes[key] = deque([(command, before, future)])
+        self._executor.submit(self._drain, key)
+        return future
+
+    def _submit_macro(self, macro: 'MacroCommand', before: Callable = None) -> Future:
+        return gather_futures([self.submit(c, before) for c in macro.commands])
+
+    def _drain(self, key):
+        lane = self._lanes[key]
+        while True:
+            with self._lock:
+                if not lane:
+                    del self._lanes[key]
+                    return
+                command, before, future = lane.popleft()
+            result = error = None
+            is_running = future.set_running_or_notify_cancel()
+            if is_running:
+                try:
+                    if before is not None:
+                        before(command)
+                    result = command()
+                except BaseException as exc:
+                    error = exc
+            with self._lock:
+                self.completed += 1
+            if not is_running:
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def queue_depth(self, device: DeviceInterface = None) -> int:
+        with self._lock:
+            if device is not None:
+                return len(self._lanes.get(device, ()))
+            return sum(len(lane) for lane in self._lanes.values())
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'pending': self.submitted - self.completed,
+                'queued': sum(len(lane) for lane in self._lanes.values()),
+                'active_devices': len(self._lanes),
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+class CommandJournal:
+    """
+    Журнал нажатий кнопок в бинарном файле из записей фиксированной длины
+    (seq, event, timestamp, slot, direction, device_id, prev_state, state).
+    Одно нажатие (seq) может состоять из нескольких событий (event) и затрагивать несколько устройств.
+    Записи копятся в буфере и сбрасываются на диск с fsync пачками по batch_size.
+    Журнал сжимается, когда после прошлого сжатия в нём добавилось больше compact_threshold записей.
+    """
+    OFF = 0
+    ON = 1
+    STATE = 2
+    RESTORE = 3
+    NO_DEVICE = -1
+    RECORD = struct.Struct('<IIdibihh')
+
+    def __init__(self, path: str, batch_size: int = 64, history_depth: int = 100, compact_threshold: int = None):
+        if compact_threshold is not None and compact_threshold < 1:
+            raise ValueError('Compact threshold must be positive')
+        self.path = path
+        self.batch_size = batch_size
+        self.history_depth = history_depth
+        self.compact_threshold = compact_threshold
+        self._lock = threading.Lock()
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._file = open(path, 'ab')
+        size = self._file.tell()
+        if size % self.RECORD.size:
+            self._file.truncate(size - size % self.RECORD.size)
+        records = self._read()
+        self.records_count = len(records)
+        self._compacted_count = 0
+        self._seq = max((r[0] for r in records), default=0) + 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def next_seq(self) -> int:
+        with self._lock:
+            seq = self._seq
+            self._seq += 1
+            return seq
+
+    def append_entry(self, seq: int, events: list[tuple[int, int, list[tuple[int, int, int]]]]):
+        """
+        events - [(slot, direction, [(device_id, prev_state, state), ...]), ...]
+        Нажатие попадает в буфер целиком, только если упаковались все его записи.
+        """
+        pack = self.RECORD.pack
+        timestamp = time.time()
+        entry = bytearray()
+        count = 0
+        for event, (slot, direction, devices) in enumerate(events):
+            for device_id, prev_state, state in devices or [(self.NO_DEVICE, 0, 0)]:
+                entry += pack(seq, event, timestamp, slot, direction, device_id, prev_state, state)
+                count += 1
+        with self._lock:
+            self._buffer += entry
+            self._buffered += count
+            if self._buffered >= self.batch_size:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.records_count += self._buffered
+            self._buffer.clear()
+            self._buffered = 0
+        if self.compact_threshold and self.records_count - self._compacted_count > self.compact_threshold:
+            self._compact()
+
+    def replay(self) -> list[tuple]:
+        """Все записи журнала по порядку нажатий"""
+        with self._lock:
+            self._flush()
+            return self._read()
+
+    def _read(self) -> list[tuple]:
+        size = os.path.getsize(self.path)
+        size -= size % self.RECORD.size
+        if not size:
+            return []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view:
+                records = list(self.RECORD.iter_unpack(view[:size]))
+        records.sort(key=lambda r: r[:2])
+        return records
+
+    def compact(self):
+        with self._lock:
+            self._flush()
+            self._compact()
+
+    def _compact(self):
+        """
+        Оставляет последние history_depth неотменённых нажатий и текущие состояния устройств.
+        Записи RESTORE снимают нажатия с истории и после сжатия не нужны.
+        """
+        records = self._read()
+        states = {}
+        seqs = []
+        current_seq = None
+        for seq, _, _, _, direction, device_id, _, state in records:
+            if device_id != self.NO_DEVICE:
+                states[device_id] = state
+            if seq == current_seq:
+                continue
+            current_seq = seq
+            if direction == self.RESTORE:
+                if seqs:
+                    seqs.pop()
+            elif direction != self.STATE:
+                seqs.append(seq)
+        kept_seqs = set(seqs[-self.history_depth:])
+        kept = [r for r in records if r[0] in kept_seqs]
+
+        state_seq = self._seq
+        self._seq += 1
+        timestamp = time.time()
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in kept:
+                f.write(self.RECORD.pack(*record))
+            for device_id, state in states.items():
+                f.write(self.RECORD.pack(state_seq, 0, timestamp, -1, self.STATE, device_id, state, state))
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'ab')
+        self.records_count = self._compacted_count = len(kept) + len(states)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+def get_command_name(command: CommandInterface | Callable) -> str:
+    if (device := getattr(command, '__self__', None)) is not None:
+        return f'{device.__class__.__name__}.{command.__name__}'
+    return command.__class__.__name__
+
+
+class DispatchInstrumentation:
+    """
+    Число вызовов и гистограммы задержек команд по слотам и по классам команд.
+    tracer(slot, command, elapsed_ns), если задан, вызывается после каждой команды.
+    Кнопки undo/redo/restore учитываются в слоте -1.
+    """
+    slots: dict[int, LatencyHistogram]
+    commands: dict[str, LatencyHistogram]
+
+    def __init__(self, tracer: Callable = None, **histogram_options):
+        self.tracer = tracer
+        self.histogram_options = histogram_options
+        self.slots = {}
+        self.commands = {}
+        self._lock = threading.Lock()
+
+    def observe(self, slot: int, command: CommandInterface | Callable, started_ns: int, future: Future = None):
+        if future is None:
+            self.record(slot, command, time.perf_counter_ns() - started_ns)
+        else:
+            future.add_done_callback(lambda _: self.record(slot, command, time.perf_counter_ns() - started_ns))
+
+    def record(self, slot: int, command: CommandInterface | Callable, elapsed_ns: int):
+        name = get_command_name(command)
+        with self._lock:
+            if (histogram := self.slots.get(slot)) is None:
+                histogram = self.slots[slot] = LatencyHistogram(**self.histogram_options)
+            histogram.record(elapsed_ns)
+            if (histogram := self.commands.get(name)) is None:
+                histogram = self.commands[name] = LatencyHistogram(**self.histogram_options)
+            histogram.record(elapsed_ns)
+        if self.tracer is not None:
+            self.tracer(slot, command, elapsed_ns)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'slots': {slot: h.as_dict() for slot, h in self.slots.items()},
+                'commands': {name: h.as_dict() for name, h in self.commands.items()},
+            }
+
+    def to_prometheus(self, prefix: str = 'remote_control') -> str:
+        lines = [f'# TYPE {prefix}_slot_latency_seconds summary']
+        with self._lock:
+            for slot, histogram in sorted(self.slots.items()):
+                lines += histogram.to_prometheus(f'{prefix}_slot_latency_seconds', f'slot="{slot}"')
+            lines.append(f'# TYPE {prefix}_command_latency_seconds summary')
+            for name, histogram in sorted(self.commands.items()):
+                lines += histogram.to_prometheus(f'{prefix}_command_latency_seconds', f'command="{name}"')
+        return '\n'.join(lines) + '\n'
+
+
+class CommandLog:
+    """
+    История нажатий ограниченной глубины в массивах, без живой команды и снимка в каждой записи.
+    Запись - (command_id, slot, direction, group, seq), за ней в общих массивах подряд (device_id, prev_state)
+    устройств до нажатия. Команды и устройства хранятся по одному разу в таблицах интернирования.
+    Записи одного нажатия (group) отменяются вместе, при переполнении вытесняется самое старое нажатие.
+    Вытесненные записи вырезаются из массивов пачкой, поэтому put и pop - амортизированно O(1).
+    В режиме executor состояния до нажатия известны только после выполнения команды в очереди устройства:
+    до fill запись держит DeviceSnapshot, который заполняет очередь.
+    """
+    _commands: list[CommandInterface | Callable]
+    _command_ids: dict[CommandInterface | Callable, int]
+    _devices: list[DeviceInterface]
+    _device_ids: dict[DeviceInterface, int]
+    pending: dict[int, DeviceSnapshot]
+
+    def __init__(self, depth: int = 100):
+        if depth < 1:
+            raise ValueError('Undo history depth must be positive')
+        self.depth = depth
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._groups = itertools.count(1)
+        self._groups_count = 0
+        self._last_group = 0
+        self._head = 0
+        self._reset()
+
+    def _reset(self):
+        self._commands = []
+        self._command_ids = {}
+        self._devices = []
+        self._device_ids = {}
+        self.command_ids = array('I')
+        self.slots = array('i')
+        self.directions = array('b')
+        self.groups = array('I')
+        self.seqs = array('Q')
+        self.state_starts = array('I')
+        self.device_ids = array('I')
+        self.prev_states = array('i')
+        self.pending = {}
+
+    def __len__(self):
+        """Число нажатий в истории"""
+        return self._groups_count
+
+    def __iter__(self):
+        for index in range(self._head, len(self.command_ids)):
+            yield self._commands[self.command_ids[index]]
+
+    def clear(self):
+        with self._lock:
+            self._groups_count = 0
+            self._last_group = 0
+            self._head = 0
+            self._reset()
+
+    def new_group(self) -> int:
+        """Номер нового нажатия, в историю оно попадает с первой записью"""
+        return next(self._groups)
+
+    def append(self, group: int, command: CommandInterface | Callable, slot: int, direction: int,
+               devices: tuple[DeviceInterface, ...] = (), prev_states: list[int] = None,
+               snapshot: DeviceSnapshot = None) -> int:
+        """snapshot - состояния появятся в нём позже и будут записаны через fill, prev_states не нужны"""
+        with self._lock:
+            if group != self._last_group:
+                self._last_group = group
+                self._groups_count += 1
+                if self._groups_count > self.depth:
+                    self._evict()
+            if (command_id := self._command_ids.get(command)) is None:
+                command_id = self._command_ids[command] = len(self._commands)
+                self._commands.append(command)
+            seq = self._seq = self._seq + 1
+            self.command_ids.append(command_id)
+            self.slots.append(slot)
+            self.directions.append(direction)
+            self.groups.append(group)
+            self.seqs.append(seq)
+            state_ids = self.device_ids
+            self.state_starts.append(len(state_ids))
+            for device in devices:
+                if (device_id := self._device_ids.get(device)) is None:
+                    device_id = self._device_ids[device] = len(self._devices)
+                    self._devices.append(device)
+                state_ids.append(device_id)
+            if snapshot is not None:
+                self.prev_states.extend([0] * len(devices))
+                self.pending[seq] = snapshot
+            else:
+                self.prev_states.extend(prev_states or ())
+            return seq
+
+    def fill(self, seq: int):
+        """Переносит состояния из snapshot записи seq в массивы, если запись ещё в истории"""
+        with self._lock:
+            if (snapshot := self.pending.pop(seq, None)) is None:
+                return
+            index = bisect.bisect_left(self.seqs, seq, self._head)
+            if index == len(self.seqs) or self.seqs[index] != seq:
+                return
+            start, end = self._get_states_range(index)
+            for position in range(start, end):
+                device = self._devices[self.device_ids[position]]
+                if (state := snapshot.states.get(device)) is None:
+                    state = device.get_state()
+                self.prev_states[position] = state
+
+    def pop(self) -> list[tuple] | None:
+        """
+        Записи последнего нажатия по порядку выполнения:
+        (command, slot, direction, [(device, prev_state), ...], snapshot). snapshot не None, пока не было fill.
+        """
+        with self._lock:
+            end = len(self.command_ids)
+            if end == self._head:
+                return None
+            group = self.groups[-1]
+            start = end
+            while start > self._head and self.groups[start - 1] == group:
+                start -= 1
+            entries = []
+            for index in range(start, end):
+                states_start, states_end = self._get_states_range(index)
+                states = [(self._devices[self.device_ids[position]], self.prev_states[position])
+                          for position in range(states_start, states_end)]
+                entries.append((self._commands[self.command_ids[index]], self.slots[index], self.directions[index],
+                                states, self.pending.pop(self.seqs[index], None)))
+            states_start = self.state_starts[start]
+            for column in (self.command_ids, self.slots, self.directions, self.groups, self.seqs, self.state_starts):
+                del column[start:]
+            del self.device_ids[states_start:]
+            del self.prev_states[states_start:]
+            self._groups_count -= 1
+            return entries
+
+    def _get_states_range(self, index: int) -> tuple[int, int]:
+        end = self.state_starts[index + 1] if index + 1 < len(self.state_starts) else len(self.device_ids)
+        return self.state_starts[index], end
+
+    def _evict(self):
+        end = len(self.command_ids)
+        group = self.groups[self._head]
+        while self._head < end and self.groups[self._head] == group:
+            self.pending.pop(self.seqs[self._head], None)
+            self._head += 1
+        self._groups_count -= 1
+        if self._head >= 64 and self._head * 2 >= end:
+            self._compact()
+
+    def _compact(self):
+        """Вырезает вытесненные записи и забывает команды и устройства, на которые больше никто не ссылается"""
+        head = self._head
+        states_head = self.state_starts[head] if head < len(self.state_starts) else len(self.device_ids)
+        for column in (self.command_ids, self.slots, self.directions, self.groups, self.seqs):
+            del column[:head]
+        self.state_starts = array('I', (start - states_head for start in self.state_starts[head:]))
+        del self.device_ids[:states_head]
+        del self.prev_states[:states_head]
+        self._head = 0
+
+        commands = [self._commands[i] for i in dict.fromkeys(self.command_ids)]
+        self._command_ids = {command: i for i, command in enumerate(commands)}
+        self.command_ids = array('I', (self._command_ids[self._commands[i]] for i in self.command_ids))
+        self._commands = commands
+        devices = [self._devices[i] for i in dict.fromkeys(self.device_ids)]
+        self._device_ids = {device: i for i, device in enumerate(devices)}
+        self.device_ids = array('I', (self._device_ids[self._devices[i]] for i in self.device_ids))
+        self._devices = devices
+
+
+class SlotRegistry:
+    """
+    Слоты пульта: команды хранятся в плотных списках по номеру слота.
+    Дополнительно поддерживаются индексы слотов по устройству и устройств по месту расположения.
+    Асинхронность команды определяется один раз при записи в слот, а не при каждом нажатии.
+    """
+    on_commands: list[CommandInterface | Callable]
+    off_commands: list[CommandInterface | Callable]
+    async_on_slots: set[int]
+    async_off_slots: set[int]
+    devices: list[DeviceInterface]
+    _device_ids: dict[DeviceInterface, int]
+    _devices_by_id: dict[int, DeviceInterface]
+    _device_numbers: dict[str, int]
+    _slots_by_device: dict[DeviceInterface, set[int]]
+    _devices_by_location: dict[str, dict[DeviceInterface, None]]
+    _lazy_slots_by_location: dict[str, set[int]]
+
+    def __init__(self, slots_count: int = 0):
+        no_command = NoCommand()
+        self.on_commands = [no_command] * slots_count
+        self.off_commands = [no_command] * slots_count
+        self.async_on_slots = set()
+        self.async_off_slots = set()
+        self.devices = []
+        self._device_ids = {}
+        self._devices_by_id = {}
+        self._device_numbers = {}
+        self._slots_by_device = {}
+        self._devices_by_location = {}
+        self._lazy_slots_by_location = {}
+
+    def __len__(self):
+        return len(self.on_commands)
 
     def set_command(self, slot: int, on_command: CommandInterface | Callable, off_command: CommandInterface | Callable):
-        if slot > self._slots_count:
-            print('Cannot set command in slot {slot}. All slots busy.')
-            return
+        if slot < 0:
+            raise ValueError(f'Cannot set command in slot {slot}')
+        if slot >= len(self):
+            padding = [NoCommand()] * (slot + 1 - len(self))
+            self.on_commands.extend(padding)
+            self.off_commands.extend(padding)
+        else:
+            self._unindex(slot)
+        self.on_commands[slot] = on_command
+        self.off_commands[slot] = off_command
+        self._index(slot)
+
+    def add_command(self, on_command: CommandInterface | Callable, off_command: CommandInterface | Callable) -> int:
+        slot = len(self)
+        self.set_command(slot, on_command, off_command)
+        return slot
+
+    def remove_command(self, slot: int):
+        self.set_command(slot, NoCommand(), NoCommand())
+
+    def get_on_command(self, slot: int) -> CommandInterface | Callable:
+        if slot < 0:
+            raise ValueError(f'No command in slot {slot}')
+        if (command := self.on_commands[slot]).__class__ is LazyCommand:
+            return self.resolve(slot, is_on=True)
+        return command
+
+    def get_off_command(self, slot: int) -> CommandInterface | Callable:
+        if slot < 0:
+            raise ValueError(f'No command in slot {slot}')
+        if (command := self.off_commands[slot]).__class__ is LazyCommand:
+            return self.resolve(slot, is_on=False)
+        return command
+
+    def resolve(self, slot: int, is_on: bool) -> CommandInterface | Callable:
+        """Создаёт отложенные команды слота и добавляет их устройства в индексы"""
+        on_command, off_command = self.on_commands[slot], self.off_commands[slot]
+        self._unindex_lazy(slot)
+        if isinstance(on_command, LazyCommand):
+            on_command = on_command.resolve()
+        if isinstance(off_command, LazyCommand):
+            off_command = off_command.resolve()
+        self.on_commands[slot] = on_command
+        self.off_commands[slot] = off_command
+        self._index(slot)
+        return on_command if is_on else off_command
+
+    def get_devices(self, slot: int) -> tuple[DeviceInterface, ...]:
+        devices = get_devices(self.on_commands[slot]) + get_devices(self.off_commands[slot])
+        return tuple(dict.fromkeys(devices))
+
+    def get_device_id(self, device: DeviceInterface) -> int:
+        """
+        Ключ устройства по его классу и месту расположения.
+        Не зависит от порядка, в котором загружаются и создаются устройства пульта.
+        """
+        return self._device_ids.get(device, CommandJournal.NO_DEVICE)
+
+    def get_device_by_id(self, device_id: int) -> DeviceInterface | None:
+        return self._devices_by_id.get(device_id)
+
+    def is_lazy(self, slot: int) -> bool:
+        return isinstance(self.on_commands[slot], LazyCommand) or isinstance(self.off_commands[slot], LazyCommand)
+
+    def get_slots(self, device: DeviceInterface) -> set[int]:
+        return self._slots_by_device.get(device, set())
+
+    def get_location_devices(self, location: str) -> list[DeviceInterface]:
+        self._resolve_location(location)
+        return list(self._devices_by_location.get(location, ()))
+
+    def get_location_slots(self, location: str) -> set[int]:
+        self._resolve_location(location)
+        slots = set()
+        for device in self._devices_by_location.get(location, ()):
+            slots |= self._slots_by_device[device]
+        return slots
+
+    def _resolve_location(self, location: str):
+        """Создаёт отложенные команды слотов, устройства которых находятся в location"""
+        for slot in list(self._lazy_slots_by_location.get(location, ())):
+            self.resolve(slot, is_on=True)
+
+    def _index(self, slot: int):
+        for command in (self.on_commands[slot], self.off_commands[slot]):
+            if command.__class__ is LazyCommand:
+                for location in command.locations:
+                    self._lazy_slots_by_location.setdefault(location, set()).add(slot)
+        for commands, async_slots in ((self.on_commands, self.async_on_slots),
+                                      (self.off_commands, self.async_off_slots)):
+            if commands[slot].__class__ is not LazyCommand and is_async_command(commands[slot]):
+                async_slots.add(slot)
+            else:
+                async_slots.discard(slot)
+        for device in self.get_devices(slot):
+            if device not in self._device_ids:
+                device_id = self._make_device_id(device)
+                self._device_ids[device] = device_id
+                self._devices_by_id[device_id] = device
+                self.devices.append(device)
+            self._slots_by_device.setdefault(device, set()).add(slot)
+            self._devices_by_location.setdefault(device.location, {})[device] = None
+
+    def _make_device_id(self, device: DeviceInterface) -> int:
+        """Одинаковые устройства в одном месте различаются порядковым номером"""
+        prefix = f'{device.__class__.__name__}:{device.location}'
+        number = self._device_numbers.get(prefix, 0)
+        while True:
+            device_id = zlib.crc32(f'{prefix}:{number}'.encode()) & 0x7fffffff
+            number += 1
+            if device_id not in self._devices_by_id:
+                self._device_numbers[prefix] = number
+                return device_id
+
+    def _unindex_lazy(self, slot: int):
+        for command in (self.on_commands[slot], self.off_commands[slot]):
+            if command.__class__ is not LazyCommand:
+                continue
+            for location in command.locations:
+                if (slots := self._lazy_slots_by_location.get(location)) is None:
+                    continue
+                slots.discard(slot)
+                if not slots:
+                    del self._lazy_slots_by_location[location]
+
+    def _unindex(self, slot: int):
+        self._unindex_lazy(slot)
+        for device in self.get_devices(slot):
+            slots = self._slots_by_device[device]
+            slots.discard(slot)
+            if slots:
+                continue
+            del self._slots_by_device[device]
+            devices = self._devices_by_location[device.location]
+            del devices[device]
+            if not devices:
+                del self._devices_by_location[device.location]
+
 
-        self._on_commands[slot] = on_command
-        self._off_commands[slot] = off_command
+class RemoteControl:
+    """
+    Каждое нажатие попадает в историю отмены (CommandLog) вместе с состояниями своих устройств до нажатия.
+    undo и restore возвращают устройства к этим состояниям, redo выполняет отменённое нажатие заново.
+    """
+    slots: SlotRegistry
+    undo_queue: CommandLog
+    redo_queue: CommandLog
+
+    def __init__(self, slots_count: int = 6, undo_depth: int = 100, executor: DeviceExecutor = None,
+                 journal: CommandJournal = None, instrumentation: DispatchInstrumentation = None):
+        self.slots = SlotRegistry(slots_count)
+        self.executor = executor
+        self.journal = journal
+        self.instrumentation = instrumentation
+        self.undo_queue = CommandLog(depth=undo_depth)
+        self.redo_queue = CommandLog(depth=undo_depth)
+
+    def set_command(self, slot: int, on_command: CommandInterface | Callable, off_command: CommandInterface | Callable):
+        self.slots.set_command(slot, on_command, off_command)
+
+    def add_command(self, on_command: CommandInterface | Callable, off_command: CommandInterface | Callable) -> int:
+        return self.slots.add_command(on_command, off_command)
 
     def push_on_button(self, slot):
-        self._on_commands[slot]()
-        self.undo_queue.put(self._on_commands[slot])
-        self.is_undo_set = False
+        command = self.slots.get_on_command(slot)
+        return self._push_command(slot, command, CommandJournal.ON, slot in self.slots.async_on_slots)
 
     def push_off_button(self, slot):
-        self._off_commands[slot]()
-        self.undo_queue.put(self._off_commands[slot])
-        self.is_undo_set = False
+        command = self.slots.get_off_command(slot)
+        return self._push_command(slot, command, CommandJournal.OFF, slot in self.slots.async_off_slots)
+
+    def _execute(self, command, snapshot: DeviceSnapshot = None, slot: int = -1) -> Future | None:
+        instrumentation = self.instrumentation
+        started_ns = time.perf_counter_ns() if instrumentation is not None else 0
+        before = snapshot.capture if snapshot is not None else None
+        if self.executor is not None:
+            future = self.executor.submit(command, before)
+        else:
+            future = None
+            if before is not None:
+                before(command)
+            command()
+        if instrumentation is not None:
+            instrumentation.observe(slot, command, started_ns, future)
+        return future
+
+    def _run(self, group: int, slot: int, command, direction: int, events: list) -> Future | None:
+        """Выполняет команду нажатия и записывает её с состояниями устройств до выполнения в историю"""
+        devices = get_devices(command)
+        instrumentation = self.instrumentation
+        started_ns = time.perf_counter_ns() if instrumentation is not None else 0
+        if self.executor is None:
+            future = None
+            prev_states = [device.get_state() for device in devices]
+            command()
+            self.undo_queue.append(group, command, slot, direction, devices, prev_states)
+        else:
+            prev_states = DeviceSnapshot()
+            if isinstance(command, MacroCommand):
+                command.snapshot = prev_states
+            seq = self.undo_queue.append(group, command, slot, direction, devices, snapshot=prev_states)
+            future = self.executor.submit(command, prev_states.capture)
+            future.add_done_callback(lambda _: self.undo_queue.fill(seq))
+        events.append((slot, direction, devices, prev_states))
+        if instrumentation is not None:
+            instrumentation.observe(slot, command, started_ns, future)
+        return future
+
+    def dispatch_many(self, events):
+        """
+        events - последовательность пар (slot, is_on).
+        Вся пачка выполняется и отменяется как одно нажатие.
+        """
+        on_commands = self.slots.on_commands
+        off_commands = self.slots.off_commands
+        async_on_slots = self.slots.async_on_slots
+        async_off_slots = self.slots.async_off_slots
+        presses = []
+        for slot, is_on in events:
+            if slot < 0:
+                raise ValueError(f'No command in slot {slot}')
+            command = on_commands[slot] if is_on else off_commands[slot]
+            if command.__class__ is LazyCommand:
+                command = self.slots.resolve(slot, is_on)
+            if slot in (async_on_slots if is_on else async_off_slots):
+                self._check_sync(command)
+            presses.append((slot, command, CommandJournal.ON if is_on else CommandJournal.OFF))
+        if not presses:
+            return
+        return self._push_presses(presses)
+
+    def _push_presses(self, presses: list[tuple], is_redo: bool = False) -> list[Future] | None:
+        """presses - [(slot, command, direction), ...], одно нажатие из нескольких команд"""
+        group = self.undo_queue.new_group()
+        journal_events = []
+        futures = [self._run(group, slot, command, direction, journal_events) for slot, command, direction in presses]
+        if self.executor is None:
+            futures = None
+        if self.journal is not None:
+            self._journal(journal_events, gather_futures(futures) if futures is not None else None)
+        if not is_redo:
+            self.redo_queue.clear()
+        return futures
+
+    def _push_command(self, slot, command, direction, is_async: bool):
+        if is_async:
+            self._check_sync(command)
+        group = self.undo_queue.new_group()
+        journal_events = []
+        future = self._run(group, slot, command, direction, journal_events)
+        if self.journal is not None:
+            self._journal(journal_events, future)
+        if len(self.redo_queue):
+            self.redo_queue.clear()
+        return future
+
+    @staticmethod
+    def _check_sync(command):
+        if is_async_command(command):
+            raise ValueError(f'{command} is async, use apush_on_button / apush_off_button')
 
     def push_undo_button(self):
-        if not self.is_undo_set:
-            self.undo_queue.get()
-        self.undo_queue.get()()
-        self.is_undo_set = True
+        """
+        Отменяет последнее нажатие: его устройства возвращаются к состояниям до нажатия,
+        нажатие переходит в redo. Повторные undo отменяют нажатия дальше по истории.
+        """
+        return self._restore(is_undo=True)
+
+    def push_restore_button(self):
+        """Возвращает устройства в состояние до последнего нажатия кнопки, без возможности redo"""
+        return self._restore(is_undo=False)
+
+    def _restore(self, is_undo: bool):
+        if (entries := self.undo_queue.pop()) is None:
+            return
+        command = get_restore_command(entries)
+        snapshot = DeviceSnapshot()
+        future = self._execute(command, snapshot)
+        if self.journal is not None:
+            self._journal([(-1, CommandJournal.RESTORE, get_devices(command), snapshot)], future)
+        if is_undo:
+            self._put_redo(entries)
+        return future
+
+    def _put_redo(self, entries: list[tuple]):
+        group = self.redo_queue.new_group()
+        for command, slot, direction, _, _ in entries:
+            self.redo_queue.append(group, command, slot, direction)
+
+    def push_redo_button(self):
+        if (entries := self.redo_queue.pop()) is None:
+            return
+        for command, _, _, _, _ in entries:
+            self._check_sync(command)
+        futures = self._push_presses([(slot, command, direction) for command, slot, direction, _, _ in entries],
+                                     is_redo=True)
+        if futures is not None and len(futures) == 1:
+            return futures[0]
+        return futures
+
+    async def apush_on_button(self, slot):
+        await self._apush_command(slot, self.slots.get_on_command(slot), CommandJournal.ON)
+
+    async def apush_off_button(self, slot):
+        await self._apush_command(slot, self.slots.get_off_command(slot), CommandJournal.OFF)
+
+    async def _apush_command(self, slot, command, direction):
+        devices = get_devices(command)
+        prev_states = [device.get_state() for device in devices]
+        await run_command(command)
+        self.undo_queue.append(self.undo_queue.new_group(), command, slot, direction, devices, prev_states)
+        if self.journal is not None:
+            self._journal([(slot, direction, devices, prev_states)])
+        self.redo_queue.clear()
+
+    async def apush_undo_button(self):
+        if (entries := self.undo_queue.pop()) is None:
+            return
+        command = get_restore_command(entries)
+        snapshot = DeviceSnapshot()
+        snapshot.capture(command)
+        for c in command.commands:
+            # отмена асинхронной команды возвращает корутину, run_command её дожидается
+            await run_command(c)
+        if self.journal is not None:
+            self._journal([(-1, CommandJournal.RESTORE, get_devices(command), snapshot)])
+        self._put_redo(entries)
+
+    def push_location_on_button(self, location: str):
+        return self._push_location(location, is_on=True)
+
+    def push_location_off_button(self, location: str):
+        return self._push_location(location, is_on=False)
+
+    def _push_location(self, location: str, is_on: bool):
+        """Включает или выключает все устройства в location одним отменяемым нажатием"""
+        devices = self.slots.get_location_devices(location)
+        if not devices:
+            return
+        direction = CommandJournal.ON if is_on else CommandJournal.OFF
+        presses = [(-1, d.on if is_on else d.off, direction) for d in devices]
+        for _, command, _ in presses:
+            self._check_sync(command)
+        return self._push_presses(presses)
+
+    def _journal(self, events: list[tuple], future: Future = None):
+        """events - [(slot, direction, devices, prev_states), ...], prev_states - список или DeviceSnapshot"""
+        seq = self.journal.next_seq()
+
+        def write(_=None):
+            entry = []
+            for slot, direction, devices, prev_states in events:
+                if isinstance(prev_states, DeviceSnapshot):
+                    prev_states = [prev_states.states.get(d, d.get_state()) for d in devices]
+                entry.append((slot, direction, [(self.slots.get_device_id(d), prev_state, d.get_state())
+                                                for d, prev_state in zip(devices, prev_states)]))
+            self.journal.append_entry(seq, entry)
+
+        if future is None:
+            write()
+        else:
+            future.add_done_callback(write)
+
+    def replay_journal(self):
+        """
+        Восстанавливает историю нажатий и состояния устройств из журнала после перезапуска.
+        Вызывается после того, как пульт загружен теми же командами.
+        Устройства находятся по ключам из журнала, отложенные команды нужных слотов создаются заранее.
+        """
+        records = self.journal.replay()
+        self._resolve_journal_devices(records)
+        states = {}
+        history = []
+        current_seq = None
+        for seq, event, _, slot, direction, device_id, prev_state, state in records:
+            device = self.slots.get_device_by_id(device_id)
+            if device is not None:
+                states[device] = state
+            if seq != current_seq:
+                current_seq = seq
+                if direction == CommandJournal.RESTORE and history:
+                    history.pop()
+                elif direction in (CommandJournal.ON, CommandJournal.OFF):
+                    history.append({})
+            if direction in (CommandJournal.ON, CommandJournal.OFF):
+                slot, direction, devices = history[-1].setdefault(event, (slot, direction, {}))
+                if device is not None:
+                    devices.setdefault(device, prev_state)
+
+        self.undo_queue.clear()
+        for press in history[-self.undo_queue.depth:]:
+            group = self.undo_queue.new_group()
+            for slot, direction, devices in press.values():
+                command = self._get_journal_command(slot, direction, devices)
+                self.undo_queue.append(group, command, slot, direction, tuple(devices), list(devices.values()))
+        for device, state in states.items():
+            if device.get_state() != state:
+                device.set_state(state)
+
+    def _resolve_journal_devices(self, records: list[tuple]):
+        slots = self.slots
+        journal_slots = {r[3] for r in records if 0 <= r[3] < len(slots)}
+        for slot in sorted(journal_slots):
+            if slots.is_lazy(slot):
+                slots.resolve(slot, is_on=True)
+        device_ids = {r[5] for r in records if r[5] != CommandJournal.NO_DEVICE}
+        if all(slots.get_device_by_id(device_id) is not None for device_id in device_ids):
+            return
+        # устройства макросов и кнопок по месту расположения могут жить в других слотах
+        for slot in range(len(slots)):
+            if slots.is_lazy(slot):
+                slots.resolve(slot, is_on=True)
+
+    def _get_journal_command(self, slot: int, direction: int, devices: dict[DeviceInterface, int]):
+        is_on = direction == CommandJournal.ON
+        if 0 <= slot < len(self.slots):
+            return self.slots.resolve(slot, is_on)
+        commands = [d.on if is_on else d.off for d in devices]
+        return commands[0] if len(commands) == 1 else MacroCommand(commands)
 
     def __str__(self):
-        for slot in range(self._slots_count):
-            print(f'slot {slot:<2} {str(self._on_commands[slot]):>25}  {str(self._off_commands[slot]):<25}')
-        print(f'{"Undo":<7} {str(self.undo_queue.queue):>25}')
+        for slot, (on_command, off_command) in enumerate(zip(self.slots.on_commands, self.slots.off_commands)):
+            print(f'slot {slot:<2} {str(on_command):>25}  {str(off_command):<25}')
+        print(f'{"Undo":<7} {str([str(command) for command in self.undo_queue]):>25}')
         return ''
 
 
+class LazyCommand(CommandInterface):
+    """
+    Команда из файла описания пульта. Настоящая команда и её устройство создаются при первом вызове.
+    locations - места расположения её устройств по описанию, известны заранее.
+    """
+    reference: str
+    locations: frozenset[str]
+    _command: CommandInterface | Callable | None
+
+    def __init__(self, loader: 'LayoutRemoteControlLoader', reference: str):
+        self.loader = loader
+        self.reference = reference
+        self.locations = loader.get_locations(reference)
+        self._command = None
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def undo(self):
+        return undo_command(self.resolve())
+
+    def __str__(self):
+        return self.reference
+
+    def resolve(self) -> CommandInterface | Callable:
+        if self._command is None:
+            self._command = self.loader.get_command(self.reference)
+        return self._command
+
+
+def get_subclasses(cls) -> dict[str, type]:
+    subclasses = {}
+    for subclass in cls.__subclasses__():
+        subclasses[subclass.__name__] = subclass
+        subclasses.update(get_subclasses(subclass))
+    return subclasses
+
+
+@functools.lru_cache(maxsize=16)
+def _parse_layout(path: str, mtime_ns: int) -> dict:
+    with open(path, 'rb') as f:
+        if path.endswith('.toml'):
+            return tomllib.load(f)
+        return json.load(f)
+
+
+def load_layout(path: str) -> dict:
+    """Разобранное описание пульта, кешируется до изменения файла"""
+    return _parse_layout(path, os.stat(path).st_mtime_ns)
+
+
+class LayoutRemoteControlLoader:
+    """
+    Загружает пульт из описания в JSON или TOML:
+        devices - {name: {type, location}},
+        macros - {name: [command, ...]},
+        slots - [{slot, on, off}, ...].
+    Команда задаётся как "device.method", "device:CommandClass" или имя макроса.
+    Устройства одного типа в одном месте - один и тот же объект.
+    """
+    _devices: dict[tuple[str, str], DeviceInterface]
+    _commands: dict[str, CommandInterface | Callable]
+
+    def __init__(self, remote_control_: RemoteControl, path: str):
+        self.remote_control = remote_control_
+        self.path = path
+        self.layout = None
+        self._devices = {}
+        self._commands = {}
+
+    def load(self):
+        self.layout = load_layout(self.path)
+        for slot_layout in self.layout['slots']:
+            self.remote_control.set_command(slot_layout['slot'],
+                                            LazyCommand(self, slot_layout['on']),
+                                            LazyCommand(self, slot_layout['off']))
+
+    def get_device(self, name: str) -> DeviceInterface:
+        if (device_layout := self.layout['devices'].get(name)) is None:
+            raise ValueError(f'Unknown device {name}')
+        key = device_layout['type'], device_layout['location']
+        if (device := self._devices.get(key)) is None:
+            if (device_class := get_subclasses(DeviceInterface).get(device_layout['type'])) is None:
+                raise ValueError(f'Unknown device type {device_layout["type"]}')
+            device = self._devices[key] = device_class(location=device_layout['location'])
+            register_inverse(device.on, device.off)
+        return device
+
+    def get_locations(self, reference: str) -> frozenset[str]:
+        """Места расположения устройств команды по описанию, без создания устройств"""
+        if (macro := self.layout.get('macros', {}).get(reference)) is not None:
+            return frozenset().union(*(self.get_locations(r) for r in macro))
+        name = reference.split(':', 1)[0] if ':' in reference else reference.split('.', 1)[0]
+        if (device_layout := self.layout['devices'].get(name)) is None:
+            return frozenset()
+        return frozenset((device_layout['location'],))
+
+    def get_command(self, reference: str) -> CommandInterface | Callable:
+        if (command := self._commands.get(reference)) is None:
+            command = self._commands[reference] = self._create_command(reference)
+        return command
+
+    def _create_command(self, reference: str) -> CommandInterface | Callable:
+        if (macro := self.layout.get('macros', {}).get(reference)) is not None:
+            return MacroCommand([self.get_command(r) for r in macro])
+        if ':' in reference:
+            name, command_name = reference.split(':', 1)
+            if (command_class := get_subclasses(CommandInterface).get(command_name)) is None:
+                raise ValueError(f'Unknown command {command_name}')
+            return command_class(device=self.get_device(name))
+        if '.' in reference:
+            name, method = reference.split('.', 1)
+            return getattr(self.get_device(name), method)
+        raise ValueError(f'Unknown command {reference}')
+
+
 class RemoteControlLoader:
 
     def __init__(self, remote_control_: RemoteControl):
@@ -255,6 +1527,9 @@ class RemoteControlLoader:
 
         stereo = Stereo(location='Room')
 
+        register_inverse(kitchen_light.on, kitchen_light.off)
+        register_inverse(stereo.on, stereo.off)
+
         commands_on = [kitchen_light.on, ceiling_fan_medium_command, stereo.on]
         commands_off = [kitchen_light.off, ceiling_fan_off_command, stereo.off]
         macro_on_commands = MacroCommand(commands_on)
@@ -304,11 +1579,86 @@ if __name__ == '__main__':
     remote_control.push_undo_button()
     print('-- set undo --')
     remote_control.push_undo_button()
+    print('-- set redo --')
+    remote_control.push_redo_button()
     print('--')
     remote_control.push_on_button(4)
     remote_control.push_off_button(4)
 
+    print('--- Batch ---')
+    remote_control.dispatch_many([(0, True), (1, True), (0, False), (1, False)])
+    print('-- set undo --')
+    remote_control.push_undo_button()
+    print('--')
+
     print('--- START PARTY ---')
     remote_control.push_on_button(5)
     print('--- END PARTY ---')
     remote_control.push_off_button(5)
+
+    print('--- Undo party ---')
+    remote_control.push_on_button(5)
+    print('-- undo macro --')
+    remote_control.slots.on_commands[5].undo()
+
+    print('--- Restore ---')
+    remote_control.push_on_button(3)
+    remote_control.push_on_button(4)
+    remote_control.push_off_button(3)
+    print('-- set restore --')
+    remote_control.push_restore_button()
+    print('-- set restore --')
+    remote_control.push_restore_button()
+
+    print('--- Kitchen off ---')
+    remote_control.push_on_button(0)
+    remote_control.push_location_off_button('Kitchen')
+
+    print('--- Executor ---')
+    remote_control.executor = DeviceExecutor(max_workers=4)
+    futures = [remote_control.push_on_button(2), remote_control.push_on_button(4), remote_control.push_on_button(0)]
+    for future in futures:
+        future.result()
+    print(remote_control.executor.metrics())
+    remote_control.executor.shutdown()
+    remote_control.executor = None
+
+    print('--- Journal ---')
+    journal_path = os.path.join(tempfile.mkdtemp(), 'remote_control.journal')
+    with CommandJournal(journal_path) as journal:
+        remote_control.journal = journal
+        remote_control.push_on_button(0)
+        remote_control.push_on_button(3)
+        remote_control.journal = None
+    print('-- restart --')
+    with CommandJournal(journal_path) as journal:
+        restarted_remote_control = RemoteControl(journal=journal)
+        RemoteControlLoader(remote_control_=restarted_remote_control).load()
+        restarted_remote_control.replay_journal()
+        print('-- set restore --')
+        restarted_remote_control.push_restore_button()
+    os.remove(journal_path)
+
+    print('--- Layout ---')
+    layout_remote_control = RemoteControl()
+    LayoutRemoteControlLoader(layout_remote_control, os.path.join(os.path.dirname(__file__), 'remote_control.json')).load()
+    print(layout_remote_control)
+    layout_remote_control.push_on_button(3)
+    layout_remote_control.push_on_button(5)
+    layout_remote_control.push_location_off_button('Room')
+
+    print('--- Instrumentation ---')
+    remote_control.instrumentation = DispatchInstrumentation()
+    remote_control.push_on_button(0)
+    remote_control.push_on_button(4)
+    remote_control.push_undo_button()
+    print(remote_control.instrumentation.as_dict()['slots'][4])
+    remote_control.instrumentation = None
+
+    print('--- Async party ---')
+    party = AsyncMacroCommand(remote_control.slots.on_commands[5].commands, limit=2)
+    asyncio.run(party())
+    remote_control.set_command(5, party, remote_control.slots.off_commands[5])
+    asyncio.run(remote_control.apush_off_button(5))
+    print('-- set undo --')
+    asyncio.run(remote_control.apush_undo_button())
@@ -1,5 +1,18 @@
+import functools
+import itertools
+import os
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from enum import StrEnum
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class Size(StrEnum):
     S = 'S'
@@ -13,7 +26,9 @@ class Beverage:
     _size: Size = Size.M
 
     def __str__(self):
-        return f'{self.get_desc():<30} Cost = {self.cost():<5} Size = {self.get_size():<4}'
+        if (line := MENU.render(self)) is not None:
+            return line
+        return render_line(self.get_desc(), self.cost(), self.get_size())
 
     def cost(self):
         return self._size_prices.get(self.get_size())
@@ -21,6 +36,11 @@ class Beverage:
     def get_desc(self):
         return self._desc
 
+    @classmethod
+    def set_size_price(cls, size: Size, price: float):
+        cls._size_prices[size] = price
+        MENU.invalidate()
+
     def set_size(self, size: Size):
         self._size = size
 
@@ -34,9 +54,6 @@ class Espresso(Beverage):
                     Size.M: 1.99,
                     Size.L: 2.5}
 
-    def cost(self):
-        return self._size_prices.get(self.get_size())
-
 
 class HouseBlend(Beverage):
     _desc = 'House blend coffe'
@@ -59,6 +76,70 @@ class NoCoffe(Beverage):
                     Size.L: 1.35}
 
 
+class BeverageOrder:
+    """
+    Напиток с добавками без цепочки обёрток: основа и добавки по порядку.
+    add возвращает новый заказ, который ссылается на исходный через parent, как BeverageValue,
+    поэтому сборка из N добавок - O(N), а не копирование кортежа на каждой.
+    Цена считается от parent и кэшируется в каждом звене для текущего размера основы и версии цен MENU.
+    """
+    __slots__ = ('base', 'condiment', 'parent', '_condiments', '_desc', '_cost', '_cost_size', '_cost_version')
+
+    def __init__(self, base: Beverage, condiment: type['Condiment'] | None = None,
+                 parent: 'BeverageOrder | None' = None):
+        self.base = base
+        self.condiment = condiment
+        self.parent = parent
+        self._condiments = None
+        self._desc = None
+        self._cost = None
+        self._cost_size = None
+        self._cost_version = None
+
+    def add(self, condiment: type['Condiment']) -> 'BeverageOrder':
+        return BeverageOrder(self.base, condiment, self)
+
+    @property
+    def condiments(self) -> tuple[type['Condiment'], ...]:
+        if self._condiments is None:
+            condiments = []
+            order = self
+            while order.parent is not None:
+                condiments.append(order.condiment)
+                order = order.parent
+            self._condiments = tuple(reversed(condiments))
+        return self._condiments
+
+    def cost(self):
+        size = self.base.get_size()
+        version = MENU.price_version
+        if self._cost_size == size and self._cost_version == version:
+            return self._cost
+        chain = []
+        order = self
+        while order is not None and (order._cost_size != size or order._cost_version != version):
+            chain.append(order)
+            order = order.parent
+        cost = order._cost if order is not None else None
+        for order in reversed(chain):
+            cost = order.base.cost() if order.parent is None else round(order.condiment._price + cost, 2)
+            order._cost = cost
+            order._cost_size = size
+            order._cost_version = version
+        return cost
+
+    def get_desc(self):
+        if self._desc is None:
+            self._desc = ', '.join([self.base.get_desc(), *(condiment._name for condiment in self.condiments)])
+        return self._desc
+
+    def invalidate(self):
+        order = self
+        while order is not None and order._cost_size is not None:
+            order._cost_size = None
+            order = order.parent
+
+
 class CondimentDecorator(Beverage):
     _beverage: Beverage
 
@@ -74,8 +155,24 @@ class CondimentDecorator(Beverage):
     def get_size(self):
         return self._beverage.get_size()
 
+    def set_size(self, size: Size):
+        self._beverage.set_size(size)
+
 
 class Condiment(CondimentDecorator):
+    """
+    Обёртка над Condiment не увеличивает цепочку: добавка дописывается в плоский BeverageOrder.
+    Добавка, которая считает цену или описание по-своему, становится основой нового заказа,
+    и её cost и get_desc вызываются как есть.
+    """
+    _order: BeverageOrder
+
+    def __init__(self, beverage_: Beverage):
+        super().__init__(beverage_)
+        if isinstance(beverage_, Condiment) and not _overrides_order(type(beverage_)):
+            self._order = beverage_._order.add(type(self))
+        else:
+            self._order = BeverageOrder(beverage_).add(type(self))
 
     @property
     def _name(self):
@@ -85,11 +182,23 @@ class Condiment(CondimentDecorator):
     def _price(self):
         raise NotImplementedError
 
+    @classmethod
+    def set_price(cls, price: float):
+        cls._price = price
+        MENU.invalidate()
+
     def cost(self):
-        return round(self._price + self._beverage.cost(), 2)
+        return self._order.cost()
 
     def get_desc(self):
-        return self._beverage.get_desc() + f', {self._name}'
+        return self._order.get_desc()
+
+    def get_size(self):
+        return self._order.base.get_size()
+
+    def set_size(self, size: Size):
+        self._order.base.set_size(size)
+        self._order.invalidate()
 
 
 class Mocha(Condiment):
@@ -107,6 +216,385 @@ class Whip(Condiment):
     _price = .10
 
 
+SIZES = tuple(Size)
+
+
+def render_line(desc: str, cost, size: Size) -> str:
+    return f'{desc:<30} Cost = {cost:<5} Size = {size:<4}'
+
+
+def get_subclasses(cls) -> list[type]:
+    subclasses = []
+    for subclass in cls.__subclasses__():
+        subclasses.append(subclass)
+        subclasses.extend(get_subclasses(subclass))
+    return subclasses
+
+
+def get_menu() -> tuple[list[type[Beverage]], list[type[Condiment]]]:
+    """Все основы с _size_prices и все добавки с ценой, объявленные на момент вызова"""
+    bases = [b for b in get_subclasses(Beverage) if not issubclass(b, CondimentDecorator) and '_size_prices' in vars(b)]
+    condiments = [c for c in get_subclasses(Condiment) if isinstance(c._price, (int, float))]
+    return bases, condiments
+
+
+@functools.cache
+def _overrides_order(cls: type) -> bool:
+    """Класс считает цену, описание или размер по-своему, и по его атрибутам заказ не собрать"""
+    parent = Condiment if issubclass(cls, Condiment) else Beverage
+    return any(getattr(cls, name) is not getattr(parent, name) for name in ('cost', 'get_desc', 'get_size'))
+
+
+class MenuCatalogue:
+    """
+    Меню из классов основ и добавок с интернированными описаниями.
+    Описание, цена и строка чека заказа (основа, размер, добавки по порядку) запоминаются в LRU-кэше
+    на cache_size заказов, повторный заказ - попадание в словарь без обхода цепочки.
+    Цены берутся из классов при сборке записи: после изменения цен нужен invalidate,
+    его вызывают Beverage.set_size_price и Condiment.set_price. invalidate увеличивает price_version,
+    по которой сбрасывают свои кэши цен BeverageOrder и конвейер price_orders_file.
+    Новые классы попадают в меню после rebuild.
+    Классы, которые переопределяют cost, get_desc или get_size, в кэш не попадают.
+    """
+    descs: dict[type, str]
+    bases: frozenset[type[Beverage]]
+    condiments: frozenset[type[Condiment]]
+
+    def __init__(self, bases: list[type[Beverage]], condiments: list[type[Condiment]], cache_size: int = 4096):
+        self._lookup = functools.lru_cache(maxsize=cache_size)(self._build)
+        self.price_version = 0
+        self._load(bases, condiments)
+
+    @classmethod
+    def from_menu(cls, cache_size: int = 4096) -> 'MenuCatalogue':
+        return cls(*get_menu(), cache_size=cache_size)
+
+    def _load(self, bases: list[type[Beverage]], condiments: list[type[Condiment]]):
+        self.descs = {base: sys.intern(base._desc) for base in bases}
+        self.descs.update({condiment: sys.intern(condiment._name) for condiment in condiments})
+        self.bases = frozenset(bases)
+        self.condiments = frozenset(condiments)
+        self.classes = {cls.__name__: cls for cls in (*bases, *condiments)}
+        self._overriding = {cls for cls in (*bases, *condiments) if _overrides_order(cls)}
+        self.invalidate()
+
+    def rebuild(self):
+        """Перечитывает классы меню, например после объявления новых напитков"""
+        self._load(*get_menu())
+
+    def _build(self, base: type[Beverage], size: Size, condiments: tuple) -> tuple[str, float, str] | None:
+        if base not in self.bases or base in self._overriding or (cost := base._size_prices.get(size)) is None:
+            return None
+        names = [self.descs[base]]
+        for condiment in condiments:
+            if condiment not in self.condiments or condiment in self._overriding:
+                return None
+            cost = round(condiment._price + cost, 2)
+            names.append(self.descs[condiment])
+        desc = sys.intern(', '.join(names))
+        return desc, cost, render_line(desc, cost, size)
+
+    def invalidate(self):
+        """Сбрасывает кэш заказов, строки чека дальше собираются по текущим ценам классов"""
+        self.price_version += 1
+        self._lookup.cache_clear()
+
+    @staticmethod
+    def get_key(beverage_: Beverage) -> tuple[type[Beverage], Size, tuple] | None:
+        if isinstance(beverage_, Condiment):
+            base = beverage_._order.base
+            return type(base), base.get_size(), beverage_._order.condiments
+        if isinstance(beverage_, CondimentDecorator):
+            return None
+        return type(beverage_), beverage_.get_size(), ()
+
+    def get_order(self, base: type[Beverage], size: Size, condiments: tuple = ()) -> tuple[str, float] | None:
+        """(описание, цена) заказа, None - в меню нет основы или добавки"""
+        if (order := self._lookup(base, size, tuple(condiments))) is None:
+            return None
+        return order[:2]
+
+    def render(self, beverage_: Beverage) -> str | None:
+        """Строка чека как в Beverage.__str__, None - напитка нет в меню"""
+        if (key := self.get_key(beverage_)) is None or (order := self._lookup(*key)) is None:
+            return None
+        return order[2]
+
+    def cache_info(self):
+        return self._lookup.cache_info()
+
+
+def _get_cents(price: float, cls: type) -> int:
+    if abs(price * 100 - (cents := round(price * 100))) > 1e-6:
+        raise ValueError(f'{cls.__name__} price {price} is not a whole number of cents')
+    return cents
+
+
+class BulkPricer:
+    """
+    Цены пачки заказов одним проходом по колонкам.
+    Заказ - номер основы в bases, номер размера в SIZES и число каждой добавки из condiments,
+    counts - матрица len(заказов) x len(condiments) построчно в одном массиве.
+    Цены считаются в целых центах, поэтому совпадают с последовательным round(..., 2) в Condiment.cost.
+    Цены не в целых центах так не посчитать, для них __init__ бросает ValueError.
+    С numpy считается векторно, без него - циклом по массивам.
+    """
+    bases: list[type[Beverage]]
+    condiments: list[type[Condiment]]
+
+    def __init__(self, bases: list[type[Beverage]], condiments: list[type[Condiment]]):
+        self.bases = list(bases)
+        self.condiments = list(condiments)
+        self._base_ids = {base: i for i, base in enumerate(self.bases)}
+        self._condiment_ids = {condiment: i for i, condiment in enumerate(self.condiments)}
+        self._size_ids = {size: i for i, size in enumerate(SIZES)}
+        self.base_cents = array('q', [_get_cents(base._size_prices[size], base)
+                                      for base in self.bases for size in SIZES])
+        self.condiment_cents = array('q', [_get_cents(condiment._price, condiment) for condiment in self.condiments])
+
+    @classmethod
+    def from_menu(cls) -> 'BulkPricer':
+        return cls(*get_menu())
+
+    def encode(self, beverages) -> tuple[array, array, array]:
+        base_ids = array('H')
+        size_ids = array('B')
+        counts = array('I', bytes(4 * len(self.condiments) * len(beverages)))
+        width = len(self.condiments)
+        for row, beverage_ in enumerate(beverages):
+            if isinstance(beverage_, BeverageValue):
+                base, size, condiments = beverage_.base, beverage_.size, beverage_.condiments
+            elif isinstance(beverage_, Condiment):
+                base, size, condiments = type(beverage_._order.base), beverage_.get_size(), beverage_._order.condiments
+            else:
+                base, size, condiments = type(beverage_), beverage_.get_size(), ()
+            if (base_id := self._base_ids.get(base)) is None:
+                raise ValueError(f'{base.__name__} is not in the price table')
+            base_ids.append(base_id)
+            size_ids.append(self._size_ids[size])
+            for condiment in condiments:
+                if (condiment_id := self._condiment_ids.get(condiment)) is None:
+                    raise ValueError(f'{condiment.__name__} is not in the price table')
+                counts[row * width + condiment_id] += 1
+        return base_ids, size_ids, counts
+
+    def price(self, base_ids, size_ids, counts) -> array:
+        if np is not None:
+            return array('d', self._price_numpy(base_ids, size_ids, counts).tobytes())
+        return self._price_array(base_ids, size_ids, counts)
+
+    def _price_numpy(self, base_ids, size_ids, counts):
+        base_cents = np.frombuffer(self.base_cents, dtype=np.int64)
+        condiment_cents = np.frombuffer(self.condiment_cents, dtype=np.int64)
+        base_ids = np.asarray(base_ids, dtype=np.intp)
+        size_ids = np.asarray(size_ids, dtype=np.intp)
+        counts = np.asarray(counts, dtype=np.int64).reshape(len(base_ids), len(self.condiments))
+        return (base_cents[base_ids * len(SIZES) + size_ids] + counts @ condiment_cents) / 100
+
+    def _price_array(self, base_ids, size_ids, counts) -> array:
+        base_cents = self.base_cents
+        condiment_cents = self.condiment_cents
+        width = len(condiment_cents)
+        sizes_count = len(SIZES)
+        prices = array('d', bytes(8 * len(base_ids)))
+        for row, (base_id, size_id) in enumerate(zip(base_ids, size_ids)):
+            cents = base_cents[base_id * sizes_count + size_id]
+            if width:
+                cents += sum(map(int.__mul__, counts[row * width:(row + 1) * width], condiment_cents))
+            prices[row] = cents / 100
+        return prices
+
+    def price_beverages(self, beverages) -> array:
+        return self.price(*self.encode(beverages))
+
+    def decode(self, data: bytes) -> tuple[array, array, array]:
+        """
+        Колонки из заказов в формате format_order, по одному в строке, без создания объектов напитков.
+        Пустые строки и строки из одних пробелов пропускаются.
+        """
+        base_ids = array('H')
+        size_ids = array('B')
+        lines = [line for line in data.splitlines() if line.strip()]
+        width = len(self.condiments)
+        counts = array('I', bytes(4 * width * len(lines)))
+        base_ids_by_name = {base.__name__.encode(): i for i, base in enumerate(self.bases)}
+        size_ids_by_name = {size.value.encode(): i for i, size in enumerate(SIZES)}
+        condiment_ids_by_name = {condiment.__name__.encode(): i for i, condiment in enumerate(self.condiments)}
+        for row, line in enumerate(lines):
+            try:
+                base, size, *condiments = line.split()
+                base_ids.append(base_ids_by_name[base])
+                size_ids.append(size_ids_by_name[size])
+                for condiment in condiments:
+                    counts[row * width + condiment_ids_by_name[condiment]] += 1
+            except KeyError as e:
+                raise ValueError(f'Unknown {e.args[0]!r} in order {line!r}') from None
+            except ValueError:
+                raise ValueError(f'Order {line!r} needs a base and a size') from None
+        return base_ids, size_ids, counts
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class BeverageValue:
+    """
+    Неизменяемый напиток: класс основы, размер и добавки. Его можно делить между потоками и использовать как ключ.
+    add возвращает новый напиток, который ссылается на исходный через parent, поэтому напитки
+    с общим началом делят одну цепочку. Цена и хэш считаются при добавлении за O(1) от parent,
+    цена - тем же последовательным round(..., 2), что и Condiment.cost.
+    pickle сохраняет основу, размер и добавки списком, а не цепочку parent, поэтому работает при любой глубине.
+    """
+    base: type[Beverage]
+    size: Size = Size.M
+    condiment: type['Condiment'] | None = None
+    parent: 'BeverageValue | None' = field(default=None, repr=False)
+    depth: int = field(init=False, repr=False)
+    _cost: float = field(init=False, repr=False)
+    _hash: int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.parent is None:
+            if self.condiment is not None:
+                raise ValueError('Condiment needs a parent beverage')
+            if (cost := self.base._size_prices.get(self.size)) is None:
+                raise ValueError(f'{self.base.__name__} has no price for size {self.size}')
+            depth, parent_hash = 0, hash((self.base, self.size))
+        else:
+            if not issubclass(self.condiment, Condiment):
+                raise ValueError(f'{self.condiment!r} is not a condiment')
+            cost = round(self.condiment._price + self.parent._cost, 2)
+            depth, parent_hash = self.parent.depth + 1, self.parent._hash
+        object.__setattr__(self, 'depth', depth)
+        object.__setattr__(self, '_cost', cost)
+        object.__setattr__(self, '_hash', hash((parent_hash, self.condiment)))
+
+    @classmethod
+    def from_beverage(cls, beverage_: Beverage) -> 'BeverageValue':
+        if isinstance(beverage_, Condiment) and not isinstance(beverage_._order.base, CondimentDecorator):
+            value = cls(type(beverage_._order.base), beverage_.get_size())
+            return value.add(*beverage_._order.condiments)
+        if isinstance(beverage_, CondimentDecorator):
+            raise ValueError(f'{type(beverage_).__name__} can not be converted to a value')
+        return cls(type(beverage_), beverage_.get_size())
+
+    def add(self, *condiments: type['Condiment']) -> 'BeverageValue':
+        value = self
+        for condiment in condiments:
+            value = BeverageValue(self.base, self.size, condiment, value)
+        return value
+
+    def with_size(self, size: Size) -> 'BeverageValue':
+        return BeverageValue(self.base, size).add(*self.condiments)
+
+    @property
+    def condiments(self) -> tuple[type['Condiment'], ...]:
+        condiments = []
+        value = self
+        while value.parent is not None:
+            condiments.append(value.condiment)
+            value = value.parent
+        return tuple(reversed(condiments))
+
+    def cost(self) -> float:
+        return self._cost
+
+    def get_desc(self) -> str:
+        if (order := MENU.get_order(self.base, self.size, self.condiments)) is not None:
+            return order[0]
+        return ', '.join([self.base._desc, *(condiment._name for condiment in self.condiments)])
+
+    def get_size(self) -> Size:
+        return self.size
+
+    def to_beverage(self) -> Beverage:
+        beverage_ = self.base()
+        beverage_.set_size(self.size)
+        for condiment in self.condiments:
+            beverage_ = condiment(beverage_)
+        return beverage_
+
+    def __reduce__(self):
+        return _load_beverage_value, (self.base, self.size, self.condiments)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, BeverageValue):
+            return NotImplemented
+        left, right = self, other
+        while left is not right:
+            if (left is None or right is None or left._hash != right._hash or left.depth != right.depth
+                    or left.base is not right.base or left.size != right.size or left.condiment is not right.condiment):
+                return False
+            left, right = left.parent, right.parent
+        return True
+
+    def __str__(self):
+        return render_line(self.get_desc(), self._cost, self.size)
+
+
+def _load_beverage_value(base: type[Beverage], size: Size, condiments: tuple) -> BeverageValue:
+    return BeverageValue(base, size).add(*condiments)
+
+
+MENU = MenuCatalogue.from_menu()
+
+
+def format_order(value: BeverageValue) -> str:
+    """Заказ строкой: основа, размер и добавки через пробел, например 'Espresso S Mocha Whip'"""
+    return ' '.join([value.base.__name__, value.size.value, *(condiment.__name__ for condiment in value.condiments)])
+
+
+def parse_order(line: str) -> BeverageValue:
+    base, size, *condiments = line.split() or ('', '')
+    try:
+        return BeverageValue(MENU.classes[base], Size(size)).add(*(MENU.classes[name] for name in condiments))
+    except KeyError as e:
+        raise ValueError(f'Unknown {e.args[0]!r} in order {line!r}') from None
+
+
+@functools.lru_cache(maxsize=1)
+def _get_pipeline_pricer(price_version: int) -> BulkPricer:
+    """Таблица цен процесса конвейера, пересобирается при смене MENU.price_version"""
+    return BulkPricer.from_menu()
+
+
+def price_order_chunk(data: bytes) -> bytes:
+    """Задача процесса конвейера: строки заказов на входе, цены float64 подряд на выходе"""
+    pricer = _get_pipeline_pricer(MENU.price_version)
+    return pricer.price(*pricer.decode(data)).tobytes()
+
+
+def price_orders_file(src: str, dst: str, chunk_size: int = 10_000, workers: int = None) -> int:
+    """
+    Цены заказов из файла src (по одному в строке, см. format_order) в файл dst, по цене в строке в том же порядке.
+    Файл читается пачками по chunk_size строк, пачки считаются в workers процессах,
+    одновременно в работе не больше 2 * workers пачек. Возвращает число заказов.
+    Пустые строки src пропускаются и строк в dst не дают.
+    """
+    if chunk_size < 1:
+        raise ValueError('Chunk size must be positive')
+    workers = workers or os.cpu_count()
+    count = 0
+    with open(src, 'rb') as orders, open(dst, 'w') as prices, ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+
+        def write(future):
+            nonlocal count
+            costs = array('d', future.result())
+            if costs:
+                prices.write('\n'.join(map(str, costs)) + '\n')
+            count += len(costs)
+
+        while chunk := b''.join(itertools.islice(orders, chunk_size)):
+            pending.append(executor.submit(price_order_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+    return count
+
+
 if __name__ == '__main__':
     coffe = Espresso()
     coffe.set_size(size=Size.S)
@@ -123,3 +611,7 @@ if __name__ == '__main__':
     print(coffe)
     coffe.set_size(Size.S)
     print(coffe)
+
+    value = BeverageValue(Espresso, Size.S).add(Mocha, Mocha, Whip)
+    print(value)
+    print(value == BeverageValue.from_beverage(value.to_beverage()), len({value, value.with_size(Size.S)}))
@@ -0,0 +1,84 @@
+from array import array
+
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек в наносекундах с фиксированным объёмом памяти, как в HDR Histogram:
+    диапазон делится на степени двойки, а каждая степень - на 2 ** sub_bucket_bits равных частей.
+    Относительная погрешность значений не больше 1 / 2 ** sub_bucket_bits.
+    """
+    counts: array
+
+    def __init__(self, max_value: int = 60 * 10 ** 9, sub_bucket_bits: int = 5):
+        self.max_value = max_value
+        self.sub_bucket_bits = sub_bucket_bits
+        self.sub_bucket_count = 1 << sub_bucket_bits
+        self.counts = array('Q', bytes(8 * (self._get_index(max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def _get_index(self, value: int) -> int:
+        if value < self.sub_bucket_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits - 1
+        return ((shift + 1) << self.sub_bucket_bits) + (value >> shift) - self.sub_bucket_count
+
+    def _get_value(self, index: int) -> int:
+        """Верхняя граница корзины"""
+        major, sub = divmod(index, self.sub_bucket_count)
+        if not major:
+            return sub
+        return ((sub + self.sub_bucket_count + 1) << (major - 1)) - 1
+
+    def record(self, value: int):
+        if value < 0:
+            value = 0
+        self.counts[self._get_index(min(value, self.max_value))] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent: float) -> int:
+        if not self.count:
+            return 0
+        rank = max(1, round(self.count * percent / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self._get_value(index), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.
+
+    def reset(self):
+        self.counts = array('Q', bytes(8 * len(self.counts)))
+        self.count = self.total = self.min = self.max = 0
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+    def to_prometheus(self, name: str, labels: str = '') -> list[str]:
+        """Строки в текстовом формате Prometheus (summary, секунды)"""
+        separator = ',' if labels else ''
+        lines = [f'{name}{{{labels}{separator}quantile="{q / 100:g}"}} {self.percentile(q) / 1e9}'
+                 for q in (50, 90, 99, 99.9)]
+        lines.append(f'{name}_sum{{{labels}}} {self.total / 1e9}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
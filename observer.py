@@ -1,9 +1,41 @@
 import asyncio
+import bisect
+import functools
+import inspect
+import math
+import mmap
+import os
+import queue
+import struct
+import sys
+import tempfile
+import threading
+import time
+import weakref
 from abc import abstractmethod, ABC
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import StrEnum
+from itertools import compress
+from multiprocessing import shared_memory
+from operator import ne, or_
+
+from metrics import LatencyHistogram
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FIELDS = ('TEMP', 'HUMIDITY')
+RENDER_CACHE_SIZE = 1024
 
 
 class ObserverInterface(ABC):
-    _subject: 'WeatherStation' = None
+    """Станция держит наблюдателей по слабым ссылкам: пока на наблюдателя ссылается только станция, он удаляется"""
+    __slots__ = ('_subject', '__weakref__')
+    _subject: 'WeatherStation'
 
     def __init__(self, subject):
         self._subject = subject
@@ -13,6 +45,19 @@ class ObserverInterface(ABC):
     def update(self, data: dict = None):
         ...
 
+    async def aupdate(self, data: dict = None):
+        """
+        Асинхронные наблюдатели переопределяют этот метод,
+        обычные выполняются в ограниченном пуле потоков станции (update_workers).
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._subject.get_update_executor(), functools.partial(self.update, data=data))
+
+    def update_batch(self, readings: list[dict]):
+        """Изменившиеся показания датчиков, data = {'SENSOR': ..., 'TEMP': ..., 'HUMIDITY': ..., 'TS': ...}"""
+        for data in readings:
+            self.update(data=data)
+
 
 class WeatherDataSubjectInterface(ABC):
 
@@ -29,33 +74,839 @@ class WeatherDataSubjectInterface(ABC):
         """ data = {'TEMP': {}, 'HUMIDITY': {}}"""
 
 
+_CHANGED_FIELDS = {
+    (True, True): FIELDS,
+    (True, False): ('TEMP',),
+    (False, True): ('HUMIDITY',),
+    (False, False): (),
+}
+
+
+def _get_changed_fields(is_temp_changed: bool, is_humidity_changed: bool) -> tuple[str, ...]:
+    return _CHANGED_FIELDS[bool(is_temp_changed), bool(is_humidity_changed)]
+
+
+class Subscription:
+    """
+    На что подписан наблюдатель: поля (TEMP, HUMIDITY), датчики и условие predicate(data).
+    sensors = None - показания станции и всех датчиков.
+    Наблюдатель и predicate - метод объекта хранятся по слабым ссылкам, чтобы подписка не держала наблюдателя.
+    """
+    __slots__ = ('_observer', 'fields', 'sensors', '_predicate')
+
+    def __init__(self, observer: ObserverInterface, fields=FIELDS, sensors=None, predicate=None):
+        self._observer = weakref.ref(observer)
+        self.fields = frozenset(fields)
+        self.sensors = frozenset(sensors) if sensors is not None else None
+        self._predicate = weakref.WeakMethod(predicate) if inspect.ismethod(predicate) else predicate
+
+    @property
+    def observer(self) -> ObserverInterface | None:
+        return self._observer()
+
+    @property
+    def predicate(self):
+        if isinstance(self._predicate, weakref.WeakMethod):
+            return self._predicate()
+        return self._predicate
+
+    @property
+    def topics(self) -> list[tuple[int | None, str]]:
+        return [(sensor, field) for sensor in self.sensors or (None,) for field in self.fields]
+
+    def accepts(self, data: dict) -> bool:
+        predicate = self.predicate
+        return predicate is None or predicate(data)
+
+
+class OverflowPolicy(StrEnum):
+    DROP_OLDEST = 'drop_oldest'
+    DROP_NEWEST = 'drop_newest'
+    BLOCK = 'block'
+    LATEST = 'latest'
+
+
+class ObserverChannel:
+    """
+    Ограниченная очередь показаний для одного наблюдателя и задача, которая их разбирает.
+    Что делать при переполнении очереди, задаёт policy:
+        DROP_OLDEST - выбросить самое старое показание, DROP_NEWEST - новое,
+        BLOCK - ждать места, LATEST - хранить только последнее показание.
+    """
+    queue: asyncio.Queue
+
+    def __init__(self, subscription: Subscription, maxsize: int = 100, policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError('Channel size must be positive')
+        self.subscription = subscription
+        self.observer = subscription.observer
+        self.policy = policy
+        self.queue = asyncio.Queue(maxsize=1 if policy == OverflowPolicy.LATEST else maxsize)
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._task = asyncio.get_running_loop().create_task(self._consume())
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    async def put(self, data: dict):
+        if not self.queue.full():
+            self.queue.put_nowait(data)
+            return
+        match self.policy:
+            case OverflowPolicy.BLOCK:
+                await self.queue.put(data)
+            case OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+            case OverflowPolicy.DROP_OLDEST | OverflowPolicy.LATEST:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+                self.queue.put_nowait(data)
+
+    async def _consume(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                await self.observer.aupdate(data=data)
+                self.delivered += 1
+            except Exception:
+                self.errors += 1
+            finally:
+                self.observer._subject.sink.flush()
+                self.queue.task_done()
+
+    async def close(self, drain: bool = True):
+        if drain:
+            await self.queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def get_stats(self) -> dict:
+        return {'depth': self.depth, 'maxsize': self.queue.maxsize, 'delivered': self.delivered,
+                'dropped': self.dropped, 'errors': self.errors}
+
+
+class SharedReadingRing:
+    """
+    Кольцевой буфер показаний в разделяемой памяти для наблюдателей в других процессах.
+    Заголовок - (seq последней записи, признак закрытия), запись - (seq, sensor, temp, humidity, ts).
+    Пишет один процесс - станция. Подписчики читают числа прямо из разделяемой памяти
+    и по seq записи узнают, что её успели перезаписать, пока они отставали.
+    """
+    HEADER_SIZE = 2
+    RECORD_SIZE = 5
+
+    def __init__(self, capacity: int = 4096, name: str = None):
+        self.capacity = capacity
+        self.is_owner = name is None
+        size = 8 * (self.HEADER_SIZE + capacity * self.RECORD_SIZE)
+        self.shm = shared_memory.SharedMemory(name=name, create=self.is_owner, size=size if self.is_owner else 0)
+        self._header = self.shm.buf[:8 * self.HEADER_SIZE].cast('q')
+        self._records = self.shm.buf[8 * self.HEADER_SIZE:size].cast('d')
+        if self.is_owner:
+            self._header[0] = self._header[1] = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def seq(self) -> int:
+        return self._header[0]
+
+    @property
+    def is_closed(self) -> bool:
+        return bool(self._header[1])
+
+    def write(self, sensor: int, temp: float, humidity: float, ts: float):
+        seq = self._header[0] + 1
+        offset = seq % self.capacity * self.RECORD_SIZE
+        records = self._records
+        records[offset] = -1.
+        records[offset + 1] = sensor
+        records[offset + 2] = temp
+        records[offset + 3] = humidity
+        records[offset + 4] = ts
+        records[offset] = seq
+        self._header[0] = seq
+
+    def read(self, last_seq: int, handler) -> tuple[int, int]:
+        """
+        Передаёт handler(sensor, temp, humidity, ts) все записи после last_seq.
+        Возвращает новый last_seq и число потерянных записей.
+        """
+        head = self._header[0]
+        lost = 0
+        if head - last_seq > self.capacity:
+            lost = head - self.capacity - last_seq
+            last_seq = head - self.capacity
+        records = self._records
+        for seq in range(last_seq + 1, head + 1):
+            offset = seq % self.capacity * self.RECORD_SIZE
+            sensor, temp, humidity, ts = records[offset + 1], records[offset + 2], records[offset + 3], records[offset + 4]
+            if records[offset] != seq:
+                lost += 1
+                continue
+            handler(int(sensor), temp, humidity, ts)
+        return head, lost
+
+    def close(self):
+        if self.is_owner:
+            self._header[1] = 1
+        self._header.release()
+        self._records.release()
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+class RingStatisticSubscriber:
+    """Подписчик на SharedReadingRing в духе StatisticDisplay, собирает статистику по окну"""
+
+    def __init__(self, window_size: int = 1000):
+        self.temps = RollingStatistic(size=window_size)
+        self.humiditys = RollingStatistic(size=window_size)
+        self.count = 0
+
+    def __call__(self, sensor: int, temp: float, humidity: float, ts: float):
+        self.temps.add(temp, timestamp=ts)
+        self.humiditys.add(humidity, timestamp=ts)
+        self.count += 1
+
+
+def run_ring_subscriber(name: str, capacity: int, handler, poll_interval: float = .001):
+    """Цикл процесса-подписчика: читает кольцо, пока станция его не закроет. Возвращает handler и число потерь."""
+    ring = SharedReadingRing(capacity=capacity, name=name)
+    last_seq = lost = 0
+    try:
+        while True:
+            is_closed = ring.is_closed
+            seq, seq_lost = ring.read(last_seq, handler)
+            lost += seq_lost
+            if seq == last_seq:
+                if is_closed:
+                    break
+                time.sleep(poll_interval)
+            last_seq = seq
+    finally:
+        ring.close()
+    return handler, lost
+
+
+class _Rollup:
+    """Агрегаты одного разрешения: файл записей (начало интервала, count, min/sum/max temp, min/sum/max humidity)"""
+    RECORD = struct.Struct('<8d')
+
+    def __init__(self, path: str, period: int):
+        self.path = path
+        self.period = period
+        # без O_APPEND: с ним pwrite текущего интервала дописывал бы запись в конец файла
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT), 'r+b')
+        size = self._file.seek(0, os.SEEK_END)
+        if size % self.RECORD.size:
+            self._file.truncate(size - size % self.RECORD.size)
+        self.count = size // self.RECORD.size
+        self._current = None
+        self._mmap = None
+        self._mapped = 0
+        if self.count:
+            self._file.seek((self.count - 1) * self.RECORD.size)
+            self._current = list(self.RECORD.unpack(self._file.read(self.RECORD.size)))
+            self.count -= 1
+
+    def add(self, ts: float, temp: float, humidity: float):
+        """Показание раньше текущего интервала учитывается в текущем интервале"""
+        start = ts - ts % self.period
+        current = self._current
+        if current is None or start > current[0]:
+            if current is not None:
+                self._write_current()
+                self.count += 1
+            self._current = [start, 1., temp, temp, temp, humidity, humidity, humidity]
+            return
+        current[1] += 1
+        current[2] = min(current[2], temp)
+        current[3] += temp
+        current[4] = max(current[4], temp)
+        current[5] = min(current[5], humidity)
+        current[6] += humidity
+        current[7] = max(current[7], humidity)
+
+    def _write_current(self):
+        if self._current is not None:
+            os.pwrite(self._file.fileno(), self.RECORD.pack(*self._current), self.count * self.RECORD.size)
+
+    def aggregate(self, start: float, end: float, total: list[float]):
+        """Добавляет к total = [count, min/sum/max temp, min/sum/max humidity] интервалы, начинающиеся в [start, end)"""
+        current = self._current
+        if current is not None and start <= current[0] < end:
+            self._merge(total, current)
+        if not self.count:
+            return
+        if self._mapped != self.count:
+            self._close_mmap()
+            self._mmap = mmap.mmap(self._file.fileno(), self.count * self.RECORD.size, access=mmap.ACCESS_READ)
+            self._mapped = self.count
+        with memoryview(self._mmap) as view, view.cast('d') as values, values[::8] as starts:
+            lo = bisect.bisect_left(starts, start)
+            hi = bisect.bisect_left(starts, end, lo)
+            for record in self.RECORD.iter_unpack(view[lo * self.RECORD.size:hi * self.RECORD.size]):
+                self._merge(total, record)
+
+    @staticmethod
+    def _merge(total: list[float], record):
+        total[0] += record[1]
+        total[1] = min(total[1], record[2])
+        total[2] += record[3]
+        total[3] = max(total[3], record[4])
+        total[4] = min(total[4], record[5])
+        total[5] += record[6]
+        total[6] = max(total[6], record[7])
+
+    def flush(self):
+        self._write_current()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _close_mmap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._mapped = 0
+
+    def close(self):
+        self.flush()
+        self._close_mmap()
+        self._file.close()
+
+
+class ReadingStore:
+    """
+    Хранилище показаний станции. Сырые показания (ts, temp, humidity) дописываются в файл path,
+    рядом в path.1m, path.1h, path.1d хранятся агрегаты min/avg/max по минутам, часам и дням.
+    get_stats собирает статистику за период из агрегатов: дни целиком, по краям часы и минуты,
+    поэтому время запроса не зависит от числа показаний. Границы периода округляются до минут.
+    Показания сбрасываются на диск с fsync пачками по batch_size.
+    """
+    RAW = struct.Struct('<3d')
+    RESOLUTIONS = (('1m', 60), ('1h', 3600), ('1d', 86400))
+
+    def __init__(self, path: str, batch_size: int = 1024):
+        self.path = path
+        self.batch_size = batch_size
+        self._buffer = bytearray()
+        self._buffered = 0
+        self._file = open(path, 'ab')
+        size = self._file.tell()
+        if size % self.RAW.size:
+            self._file.truncate(size - size % self.RAW.size)
+        self.rollups = [_Rollup(f'{path}.{name}', period) for name, period in self.RESOLUTIONS]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, ts: float, temp: float, humidity: float):
+        self._buffer += self.RAW.pack(ts, temp, humidity)
+        self._buffered += 1
+        for rollup in self.rollups:
+            rollup.add(ts, temp, humidity)
+        if self._buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        for rollup in self.rollups:
+            rollup.flush()
+
+    def get_stats(self, start: float, end: float) -> dict | None:
+        """{'COUNT': ..., 'TEMP': (min, avg, max), 'HUMIDITY': (min, avg, max)} за [start, end), None - показаний нет"""
+        total = [0, math.inf, 0., -math.inf, math.inf, 0., -math.inf]
+        minute = self.RESOLUTIONS[0][1]
+        self._aggregate(start - start % minute, math.ceil(end / minute) * minute, len(self.rollups) - 1, total)
+        count = total[0]
+        if not count:
+            return None
+        return {'COUNT': int(count), 'TEMP': (total[1], total[2] / count, total[3]),
+                'HUMIDITY': (total[4], total[5] / count, total[6])}
+
+    def _aggregate(self, start: float, end: float, level: int, total: list[float]):
+        if start >= end:
+            return
+        rollup = self.rollups[level]
+        if level:
+            lo = math.ceil(start / rollup.period) * rollup.period
+            hi = end - end % rollup.period
+            if lo >= hi:
+                return self._aggregate(start, end, level - 1, total)
+            self._aggregate(start, lo, level - 1, total)
+            rollup.aggregate(lo, hi, total)
+            return self._aggregate(hi, end, level - 1, total)
+        rollup.aggregate(start, end, total)
+
+    def get_readings(self, start: float, end: float) -> list[tuple[float, float, float]]:
+        """Сырые показания за [start, end), показания в файле идут по времени"""
+        self._file.write(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self._file.flush()
+        size = os.path.getsize(self.path)
+        if not size:
+            return []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view, view.cast('d') as values, values[::3] as times:
+                lo = bisect.bisect_left(times, start)
+                hi = bisect.bisect_left(times, end, lo)
+                return list(self.RAW.iter_unpack(view[lo * self.RAW.size:hi * self.RAW.size]))
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        for rollup in self.rollups:
+            rollup.close()
+
+
+class NotifyInstrumentation:
+    """
+    Гистограммы задержек update по наблюдателям и цикла оповещения, размер рассылки,
+    число notify_observers с изменениями и без.
+    Наблюдатель, у которого p99 больше slow_threshold_ns, попадает в slow (проверка каждые check_every вызовов).
+    demote=True - такие наблюдатели дальше получают данные через очередь в фоновом потоке и не задерживают остальных.
+    """
+    cycles: LatencyHistogram
+    fanout: LatencyHistogram
+    observers: weakref.WeakKeyDictionary[ObserverInterface, LatencyHistogram]
+
+    def __init__(self, slow_threshold_ns: int = 10 ** 7, demote: bool = False, check_every: int = 100,
+                 **histogram_options):
+        self.slow_threshold_ns = slow_threshold_ns
+        self.demote = demote
+        self.check_every = check_every
+        self.histogram_options = histogram_options
+        self.cycles = LatencyHistogram(**histogram_options)
+        self.fanout = LatencyHistogram(**histogram_options)
+        self.observers = weakref.WeakKeyDictionary()
+        self.changed = 0
+        self.unchanged = 0
+        self.slow = weakref.WeakSet()
+        self.demoted = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+
+    def deliver(self, observer: ObserverInterface, data: dict = None):
+        if self._worker is not None and observer in self.demoted:
+            self._queue.put((observer, data))
+            return
+        started_ns = time.perf_counter_ns()
+        observer.update(data=data)
+        self.record(observer, time.perf_counter_ns() - started_ns)
+
+    def record(self, observer: ObserverInterface, elapsed_ns: int):
+        with self._lock:
+            if (histogram := self.observers.get(observer)) is None:
+                histogram = self.observers[observer] = LatencyHistogram(**self.histogram_options)
+            histogram.record(elapsed_ns)
+            if histogram.count % self.check_every or observer in self.slow:
+                return
+            if histogram.percentile(99) <= self.slow_threshold_ns:
+                return
+            self.slow.add(observer)
+            if self.demote:
+                self.demoted.add(observer)
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._work, daemon=True)
+                    self._worker.start()
+
+    def record_cycle(self, started_ns: int, fanout: int):
+        with self._lock:
+            self.cycles.record(time.perf_counter_ns() - started_ns)
+            self.fanout.record(fanout)
+            self.changed += 1
+
+    def _work(self):
+        while (item := self._queue.get()) is not None:
+            observer, data = item
+            started_ns = time.perf_counter_ns()
+            try:
+                observer.update(data=data)
+            except Exception:
+                pass
+            finally:
+                observer._subject.sink.flush()
+            self.record(observer, time.perf_counter_ns() - started_ns)
+
+    def as_dict(self) -> dict:
+        """Снимок метрик, наблюдатели - ключи словарей"""
+        with self._lock:
+            total = self.changed + self.unchanged
+            return {
+                'cycles': self.cycles.as_dict(),
+                'fanout': self.fanout.as_dict(),
+                'changed': self.changed,
+                'unchanged': self.unchanged,
+                'changed_ratio': self.changed / total if total else 0.,
+                'observers': {observer: h.as_dict() for observer, h in self.observers.items()},
+                'slow': list(self.slow),
+                'demoted': list(self.demoted),
+            }
+
+    def close(self):
+        """Дожидается фоновых оповещений и останавливает поток"""
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._worker = None
+
+
 class WeatherStation(WeatherDataSubjectInterface):
+    """
+    coalesce=True - внутри работающего event loop несколько notify_observers за один проход цикла
+    сливаются в одно оповещение каждого наблюдателя с последними данными.
+    Подписки хранятся в WeakKeyDictionary: удалённые сборщиком мусора наблюдатели пропадают из них сами.
+    Наблюдатели с каналом (attach_channel) держатся каналом до detach_channel.
+    update_workers - сколько обычных наблюдателей обновляются одновременно в асинхронных оповещениях и каналах.
+    """
     temp: int = 0
     humidity: int = 0
-    observers: list[ObserverInterface] = list()
+    observers: weakref.WeakKeyDictionary[ObserverInterface, Subscription]
     is_changed: bool = False
+    sensor_temps: array
+    sensor_humiditys: array
+    sensor_times: array
+
+    def __init__(self, coalesce: bool = False, update_workers: int = 8):
+        if update_workers < 1:
+            raise ValueError('Update workers count must be positive')
+        self.observers = weakref.WeakKeyDictionary()
+        self._topics: dict[tuple[int | None, str], weakref.WeakKeyDictionary[ObserverInterface, Subscription]] = {}
+        self._changed_fields = set()
+        self.coalesce = coalesce
+        self._pending: dict[ObserverInterface, dict | None] = {}
+        self._is_flush_scheduled = False
+        self.channels: dict[ObserverInterface, ObserverChannel] = {}
+        self.shared_ring: SharedReadingRing | None = None
+        self.reading_store: ReadingStore | None = None
+        self.instrumentation: NotifyInstrumentation | None = None
+        self.sink: DisplaySink = PrintSink()
+        self.update_workers = update_workers
+        self._update_executor: ThreadPoolExecutor | None = None
+        self.sensor_temps = array('d')
+        self.sensor_humiditys = array('d')
+        self.sensor_times = array('d')
 
     def set_observers(self, observer):
-        self.observers.append(observer)
+        self.subscribe(observer)
+
+    def get_update_executor(self) -> ThreadPoolExecutor:
+        if self._update_executor is None:
+            self._update_executor = ThreadPoolExecutor(max_workers=self.update_workers, thread_name_prefix='observer')
+        return self._update_executor
+
+    def close(self):
+        """Дожидается обновлений обычных наблюдателей в пуле потоков и останавливает пул"""
+        if self._update_executor is not None:
+            self._update_executor.shutdown()
+            self._update_executor = None
+
+    def subscribe(self, observer: ObserverInterface, fields=FIELDS, sensors=None, predicate=None) -> Subscription:
+        if observer in self.observers:
+            self.remove_observer(observer)
+        subscription = self.observers[observer] = Subscription(observer, fields, sensors, predicate)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, weakref.WeakKeyDictionary())[observer] = subscription
+        return subscription
 
     def remove_observer(self, observer):
-        self.observers.remove(observer)
+        subscription = self.observers.pop(observer)
+        for topic in subscription.topics:
+            subscriptions = self._topics[topic]
+            del subscriptions[observer]
+            if not subscriptions:
+                del self._topics[topic]
+        self._pending.pop(observer, None)
+
+    def get_observers_count(self) -> int:
+        return len(self.observers)
+
+    def get_topic_counts(self) -> dict[tuple[int | None, str], int]:
+        """Живые наблюдатели по темам (sensor, field), заодно убирает темы, наблюдатели которых удалены"""
+        for topic in [topic for topic, subscriptions in self._topics.items() if not subscriptions]:
+            del self._topics[topic]
+        return {topic: len(subscriptions) for topic, subscriptions in self._topics.items()}
+
+    def get_subscriptions(self, fields, sensor: int = None) -> dict[ObserverInterface, Subscription]:
+        subscriptions = {}
+        for ref, subscription in self._get_subscriptions(fields, sensor).items():
+            if (observer := ref()) is not None:
+                subscriptions[observer] = subscription
+        return subscriptions
+
+    def _get_subscriptions(self, fields, sensor: int = None) -> dict[weakref.ref, Subscription]:
+        """Подписки по слабым ссылкам на наблюдателей, без разыменования всех ключей WeakKeyDictionary"""
+        subscriptions = {}
+        for field in fields:
+            if (topic := self._topics.get((None, field))) is not None:
+                subscriptions.update(topic.data)
+            if sensor is not None and (topic := self._topics.get((sensor, field))) is not None:
+                subscriptions.update(topic.data)
+        return subscriptions
+
+    def _pop_changed_observers(self, data: dict = None) -> list[ObserverInterface]:
+        fields = self._changed_fields or FIELDS
+        self._changed_fields = set()
+        self.is_changed = False
+        current = data or {'TEMP': self.temp, 'HUMIDITY': self.humidity}
+        return [o for o, subscription in self.get_subscriptions(fields).items() if subscription.accepts(current)]
 
     def notify_observers(self, data: dict = None):
         if data:
             self.set_weather_data(temp=data['TEMP'], humidity=data['HUMIDITY'])
-        if self.is_changed:
-            for observer in self.observers:
+        if not self.is_changed:
+            if self.instrumentation is not None:
+                self.instrumentation.unchanged += 1
+            return
+        observers = self._pop_changed_observers(data)
+        if not self.coalesce or not self._is_loop_running():
+            if (instrumentation := self.instrumentation) is None:
+                for observer in observers:
+                    observer.update(data=data)
+            else:
+                started_ns = time.perf_counter_ns()
+                for observer in observers:
+                    instrumentation.deliver(observer, data)
+                instrumentation.record_cycle(started_ns, len(observers))
+            self.sink.flush()
+            return
+
+        for observer in observers:
+            self._pending.pop(observer, None)
+            self._pending[observer] = data
+        if not self._is_flush_scheduled:
+            self._is_flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush_pending)
+
+    @staticmethod
+    def _is_loop_running() -> bool:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return True
+
+    def _flush_pending(self):
+        pending, self._pending = self._pending, {}
+        self._is_flush_scheduled = False
+        if (instrumentation := self.instrumentation) is None:
+            for observer, data in pending.items():
                 observer.update(data=data)
-        self.is_changed = False
+        else:
+            started_ns = time.perf_counter_ns()
+            for observer, data in pending.items():
+                instrumentation.deliver(observer, data)
+            instrumentation.record_cycle(started_ns, len(pending))
+        self.sink.flush()
+
+    async def anotify_observers(self, data: dict = None, timeout: float = None,
+                                limit: int = None) -> dict[ObserverInterface, BaseException]:
+        """
+        Оповещает наблюдателей одновременно.
+        timeout - ограничение времени на одного наблюдателя, limit - сколько оповещений идут одновременно.
+        Ошибка или таймаут одного наблюдателя не мешают остальным, они возвращаются в словаре.
+        Таймаут только прекращает ожидание: update обычного наблюдателя нельзя прервать,
+        он продолжает выполняться и занимает поток пула до своего завершения.
+        """
+        if data:
+            self.set_weather_data(temp=data['TEMP'], humidity=data['HUMIDITY'])
+        if not self.is_changed:
+            return {}
+
+        observers = self._pop_changed_observers(data)
+        semaphore = asyncio.Semaphore(limit) if limit else None
+
+        async def notify(observer):
+            if semaphore is None:
+                return await asyncio.wait_for(observer.aupdate(data=data), timeout)
+            async with semaphore:
+                return await asyncio.wait_for(observer.aupdate(data=data), timeout)
+
+        results = await asyncio.gather(*(notify(o) for o in observers), return_exceptions=True)
+        self.sink.flush()
+        return {o: r for o, r in zip(observers, results) if isinstance(r, BaseException)}
+
+    def attach_channel(self, observer: ObserverInterface, maxsize: int = 100,
+                       policy: OverflowPolicy = OverflowPolicy.DROP_OLDEST) -> ObserverChannel:
+        """
+        Переводит наблюдателя на получение показаний через свою очередь из publish.
+        Подписка наблюдателя сохраняется. Вызывается внутри работающего event loop.
+        """
+        if observer in self.observers:
+            subscription = self.observers[observer]
+            self.remove_observer(observer)
+        else:
+            subscription = Subscription(observer)
+        channel = self.channels[observer] = ObserverChannel(subscription, maxsize=maxsize, policy=policy)
+        return channel
+
+    async def detach_channel(self, observer: ObserverInterface, drain: bool = True):
+        await self.channels.pop(observer).close(drain=drain)
+
+    async def publish(self, data: dict):
+        """
+        Раскладывает изменившиеся показания по очередям наблюдателей.
+        Медленный наблюдатель тормозит publish, только если у его очереди политика BLOCK.
+        """
+        self.set_weather_data(temp=data['TEMP'], humidity=data['HUMIDITY'])
+        fields, self._changed_fields = self._changed_fields, set()
+        if not fields:
+            return
+        for channel in list(self.channels.values()):
+            if channel.subscription.fields & fields and channel.subscription.accepts(data):
+                await channel.put(data)
+
+    def get_channel_stats(self) -> dict[ObserverInterface, dict]:
+        return {observer: channel.get_stats() for observer, channel in self.channels.items()}
 
     def set_changed(self):
         self.is_changed = True
 
     def set_weather_data(self, temp, humidity):
+        if self.reading_store is not None:
+            self.reading_store.add(time.time(), temp, humidity)
         if not self.cur_weather or self.is_different_weather(temp, humidity):
+            if temp != self.temp:
+                self._changed_fields.add('TEMP')
+            if humidity != self.humidity:
+                self._changed_fields.add('HUMIDITY')
             self.temp = temp
             self.humidity = humidity
+            if self.shared_ring is not None:
+                self.shared_ring.write(-1, temp, humidity, time.time())
+
+    def set_sensor_data(self, sensor_id: int, temp: float, humidity: float, ts: float):
+        """Одно показание датчика, наблюдатели оповещаются только если оно изменилось"""
+        if sensor_id < 0:
+            raise ValueError(f'Invalid sensor id {sensor_id}')
+        self._reserve_sensors(sensor_id + 1)
+        fields = _get_changed_fields(self.sensor_temps[sensor_id] != temp, self.sensor_humiditys[sensor_id] != humidity)
+        if not fields:
+            return
+        self.sensor_temps[sensor_id] = temp
+        self.sensor_humiditys[sensor_id] = humidity
+        self.sensor_times[sensor_id] = ts
+        if self.shared_ring is not None:
+            self.shared_ring.write(sensor_id, temp, humidity, ts)
+        data = {'SENSOR': sensor_id, 'TEMP': temp, 'HUMIDITY': humidity, 'TS': ts}
+        for ref, subscription in self._get_subscriptions(fields, sensor_id).items():
+            if (observer := ref()) is not None and subscription.accepts(data):
+                observer.update(data=data)
+        self.sink.flush()
+
+    def set_weather_batch(self, sensor_ids, temps, humiditys, timestamps) -> int:
+        """
+        Пачка показаний датчиков в виде колонок одинаковой длины (array или numpy).
+        Сравнение с последними известными показаниями делается целиком по колонкам,
+        с numpy - векторно, без него - через map по массивам.
+        Наблюдатели получают через update_batch только изменившиеся показания, на которые они подписаны.
+        Если датчик встречается в пачке несколько раз, учитывается его последнее показание.
+        Возвращает число изменившихся показаний.
+        """
+        if not len(sensor_ids):
+            return 0
+        if (min_sensor_id := int(min(sensor_ids))) < 0:
+            raise ValueError(f'Invalid sensor id {min_sensor_id}')
+        self._reserve_sensors(int(max(sensor_ids)) + 1)
+        if np is not None:
+            changes = self._ingest_numpy(sensor_ids, temps, humiditys, timestamps)
+        else:
+            changes = self._ingest_array(sensor_ids, temps, humiditys, timestamps)
+
+        if self.shared_ring is not None:
+            write = self.shared_ring.write
+            for data, _ in changes:
+                write(data['SENSOR'], data['TEMP'], data['HUMIDITY'], data['TS'])
+
+        deliveries: dict[ObserverInterface, list[dict]] = {}
+        for data, fields in changes:
+            for ref, subscription in self._get_subscriptions(fields, data['SENSOR']).items():
+                if (observer := ref()) is not None and subscription.accepts(data):
+                    deliveries.setdefault(observer, []).append(data)
+        for observer, readings in deliveries.items():
+            observer.update_batch(readings)
+        self.sink.flush()
+        return len(changes)
+
+    def _ingest_numpy(self, sensor_ids, temps, humiditys, timestamps) -> list[tuple[dict, tuple[str, ...]]]:
+        sensor_ids = np.asarray(sensor_ids, dtype=np.intp)
+        temps, humiditys, timestamps = (np.asarray(c, dtype=np.float64) for c in (temps, humiditys, timestamps))
+        _, reversed_positions = np.unique(sensor_ids[::-1], return_index=True)
+        if len(reversed_positions) != len(sensor_ids):
+            positions = np.sort(len(sensor_ids) - 1 - reversed_positions)
+            sensor_ids, temps, humiditys, timestamps = (c[positions] for c in (sensor_ids, temps, humiditys, timestamps))
+
+        sensor_temps = np.frombuffer(self.sensor_temps, dtype=np.float64)
+        sensor_humiditys = np.frombuffer(self.sensor_humiditys, dtype=np.float64)
+        sensor_times = np.frombuffer(self.sensor_times, dtype=np.float64)
+        is_temp_changed = sensor_temps[sensor_ids] != temps
+        is_humidity_changed = sensor_humiditys[sensor_ids] != humiditys
+        changed = np.flatnonzero(is_temp_changed | is_humidity_changed)
+        is_temp_changed, is_humidity_changed = is_temp_changed[changed], is_humidity_changed[changed]
+        sensor_ids, temps, humiditys, timestamps = (c[changed] for c in (sensor_ids, temps, humiditys, timestamps))
+        sensor_temps[sensor_ids] = temps
+        sensor_humiditys[sensor_ids] = humiditys
+        sensor_times[sensor_ids] = timestamps
+        # массивы состояния нельзя расширять, пока на них есть numpy-представления
+        del sensor_temps, sensor_humiditys, sensor_times
+
+        return [({'SENSOR': sensor_id, 'TEMP': temp, 'HUMIDITY': humidity, 'TS': ts},
+                 _get_changed_fields(is_temp, is_humidity))
+                for sensor_id, temp, humidity, ts, is_temp, is_humidity
+                in zip(sensor_ids.tolist(), temps.tolist(), humiditys.tolist(), timestamps.tolist(),
+                       is_temp_changed.tolist(), is_humidity_changed.tolist())]
+
+    def _ingest_array(self, sensor_ids, temps, humiditys, timestamps) -> list[tuple[dict, tuple[str, ...]]]:
+        last_positions = dict(zip(sensor_ids, range(len(sensor_ids))))
+        if len(last_positions) != len(sensor_ids):
+            positions = sorted(last_positions.values())
+            sensor_ids, temps, humiditys, timestamps = (list(map(column.__getitem__, positions))
+                                                        for column in (sensor_ids, temps, humiditys, timestamps))
+        sensor_temps, sensor_humiditys, sensor_times = self.sensor_temps, self.sensor_humiditys, self.sensor_times
+
+        prev_temps = map(sensor_temps.__getitem__, sensor_ids)
+        prev_humiditys = map(sensor_humiditys.__getitem__, sensor_ids)
+        is_changed = list(map(or_, map(ne, temps, prev_temps), map(ne, humiditys, prev_humiditys)))
+
+        changes = []
+        for i in compress(range(len(is_changed)), is_changed):
+            sensor_id, temp, humidity, ts = sensor_ids[i], temps[i], humiditys[i], timestamps[i]
+            fields = _get_changed_fields(sensor_temps[sensor_id] != temp, sensor_humiditys[sensor_id] != humidity)
+            sensor_temps[sensor_id] = temp
+            sensor_humiditys[sensor_id] = humidity
+            sensor_times[sensor_id] = ts
+            changes.append(({'SENSOR': sensor_id, 'TEMP': temp, 'HUMIDITY': humidity, 'TS': ts}, fields))
+        return changes
+
+    def _reserve_sensors(self, count: int):
+        if count <= len(self.sensor_temps):
+            return
+        missing = array('d', [math.nan]) * (count - len(self.sensor_temps))
+        self.sensor_temps.extend(missing)
+        self.sensor_humiditys.extend(missing)
+        self.sensor_times.extend(missing)
 
     def get_temp(self):
         return self.temp
@@ -73,7 +924,166 @@ class WeatherStation(WeatherDataSubjectInterface):
         return self.cur_weather != new_weather
 
 
+class RollingStatistic:
+    """
+    Статистика по скользящему окну: среднее и дисперсия за O(1) на значение,
+    минимум и максимум за амортизированное O(1) на монотонных очередях.
+    Окно ограничивается числом значений (size) и/или временем в секундах (period),
+    без ограничений статистика считается по всем значениям и сами значения не хранятся.
+    """
+
+    def __init__(self, size: int = None, period: float = None):
+        if size is not None and size < 1:
+            raise ValueError('Window size must be positive')
+        self.size = size
+        self.period = period
+        self.is_windowed = size is not None or period is not None
+        capacity = size or 16
+        self._values = array('d', bytes(8 * capacity)) if self.is_windowed else array('d')
+        self._times = array('d', bytes(8 * capacity)) if self.is_windowed else array('d')
+        self._head = 0
+        self._length = 0
+        self._seq = 0
+        self._mins = deque()
+        self._maxs = deque()
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value: float, timestamp: float = None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.evict(timestamp)
+        if self.is_windowed:
+            if self._length == len(self._values):
+                if self.size is not None:
+                    self._pop()
+                else:
+                    self._grow()
+            index = (self._head + self._length) % len(self._values)
+            self._values[index] = value
+            self._times[index] = timestamp
+            self._length += 1
+
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        if self.is_windowed or not self._mins:
+            self._mins.append((self._seq, value))
+        if self.is_windowed or not self._maxs:
+            self._maxs.append((self._seq, value))
+        self._seq += 1
+
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    def evict(self, now: float = None):
+        """Удаляет значения, которые вышли из окна по времени"""
+        if self.period is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        while self._length and self._times[self._head] < now - self.period:
+            self._pop()
+
+    def _pop(self):
+        value = self._values[self._head]
+        seq = self._seq - self._length
+        self._head = (self._head + 1) % len(self._values)
+        self._length -= 1
+        if self._mins[0][0] == seq:
+            self._mins.popleft()
+        if self._maxs[0][0] == seq:
+            self._maxs.popleft()
+
+        self.count -= 1
+        if not self.count:
+            self.mean = self._m2 = 0.
+            return
+        delta = value - self.mean
+        self.mean -= delta / self.count
+        self._m2 -= delta * (value - self.mean)
+
+    def _grow(self):
+        capacity = len(self._values)
+        order = [(self._head + i) % capacity for i in range(self._length)]
+        self._values = array('d', (self._values[i] for i in order)) + array('d', bytes(8 * capacity))
+        self._times = array('d', (self._times[i] for i in order)) + array('d', bytes(8 * capacity))
+        self._head = 0
+
+    @property
+    def min(self) -> float | None:
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def max(self) -> float | None:
+        return self._maxs[0][1] if self._maxs else None
+
+    @property
+    def variance(self) -> float:
+        return max(self._m2, 0.) / (self.count - 1) if self.count > 1 else 0.
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class DisplaySink(ABC):
+    """Куда дисплеи выводят строки. Станция вызывает flush в конце каждого цикла оповещения"""
+
+    @abstractmethod
+    def write(self, line: str):
+        ...
+
+    def flush(self):
+        pass
+
+
+class PrintSink(DisplaySink):
+    """Каждая строка сразу выводится в stream одной записью, строки из разных потоков не перемешиваются"""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        with self._lock:
+            (self.stream or sys.stdout).write(line + '\n')
+
+
+class BufferedSink(DisplaySink):
+    """
+    Строки копятся и выводятся одной записью в stream на flush.
+    Пишут в него и поток станции, и потоки пула, каналы и фоновый поток NotifyInstrumentation.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def write(self, line: str):
+        with self._lock:
+            self._lines.append(line)
+
+    def flush(self):
+        with self._lock:
+            if not self._lines:
+                return
+            lines, self._lines = self._lines, []
+            stream = self.stream or sys.stdout
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+
+
 class DisplayInterface(ABC):
+    __slots__ = ()
 
     @abstractmethod
     def show(self):
@@ -81,6 +1091,7 @@ class DisplayInterface(ABC):
 
 
 class CurrentDisplay(ObserverInterface, DisplayInterface):
+    __slots__ = ('temp', 'humidity')
     temp: int
     humidity: int
 
@@ -93,15 +1104,26 @@ class CurrentDisplay(ObserverInterface, DisplayInterface):
             self.humidity = self._subject.get_humidity()
         self.show()
 
+    @staticmethod
+    @functools.lru_cache(maxsize=RENDER_CACHE_SIZE, typed=True)
+    def render(temp, humidity) -> str:
+        return f'{temp} {humidity}'
+
     def show(self):
-        print(f'{self.temp} {self.humidity}')
+        self._subject.sink.write(self.render(self.temp, self.humidity))
 
 
 class StatisticDisplay(ObserverInterface, DisplayInterface):
+    __slots__ = ('cur_temp', 'cur_humidity', 'temps', 'humiditys')
     cur_temp: int
     cur_humidity: int
-    temps: list[int] = list()
-    humiditys: list[int] = list()
+    temps: RollingStatistic
+    humiditys: RollingStatistic
+
+    def __init__(self, subject, window_size: int = None, window_period: float = None):
+        self.temps = RollingStatistic(size=window_size, period=window_period)
+        self.humiditys = RollingStatistic(size=window_size, period=window_period)
+        super().__init__(subject)
 
     def update(self, data=None):
         if data:
@@ -111,54 +1133,90 @@ class StatisticDisplay(ObserverInterface, DisplayInterface):
             if self._subject:
                 self.cur_temp = self._subject.get_temp()
                 self.cur_humidity = self._subject.get_humidity()
-        self.temps.append(self.cur_temp)
-        self.humiditys.append(self.cur_humidity)
+        self.temps.add(self.cur_temp)
+        self.humiditys.add(self.cur_humidity)
         self.show()
 
     def max_temp(self):
-        return max(self.temps)
+        return self.temps.max
 
     def min_temp(self):
-        return min(self.temps)
+        return self.temps.min
 
     def avg_temp(self):
-        return sum(self.temps) / len(self.temps)
+        return self.temps.mean
 
     def max_humidity(self):
-        return max(self.humiditys)
+        return self.humiditys.max
 
     def min_humidity(self):
-        return min(self.humiditys)
+        return self.humiditys.min
 
     def avg_humidity(self):
-        return sum(self.humiditys) / len(self.humiditys)
+        return self.humiditys.mean
 
     def avg_temps(self):
-        return f'{self.min_temp()}/{self.avg_temp():.0f}/{self.max_temp()}'
+        return f'{self.min_temp():g}/{self.avg_temp():.0f}/{self.max_temp():g}'
 
     def avg_humiditys(self):
-        return f'{self.min_humidity()}/{self.avg_humidity():.0f}/{self.max_humidity()}'
+        return f'{self.min_humidity():g}/{self.avg_humidity():.0f}/{self.max_humidity():g}'
+
+    @staticmethod
+    @functools.lru_cache(maxsize=RENDER_CACHE_SIZE, typed=True)
+    def render(temp, humidity) -> str:
+        return f'{temp} {humidity}'
 
     def show(self):
-        print(f'{self.cur_temp} {self.cur_humidity}')
+        self._subject.sink.write(self.render(self.cur_temp, self.cur_humidity))
 
 
 class ScreenDisplay(CurrentDisplay):
+    __slots__ = ()
 
-    def show(self):
-        print(f'Weather: {"+" if self.temp > 0 else ""}{self.temp}, humidity={self.humidity}%')
+    @staticmethod
+    @functools.lru_cache(maxsize=RENDER_CACHE_SIZE, typed=True)
+    def render(temp, humidity) -> str:
+        return f'Weather: {"+" if temp > 0 else ""}{temp}, humidity={humidity}%'
 
 
 class RusScreenDisplay(CurrentDisplay):
+    __slots__ = ()
 
-    def show(self):
-        print(f'Погода: {"+" if self.temp > 0 else ""}{self.temp}, humidity={self.humidity}%')
+    @staticmethod
+    @functools.lru_cache(maxsize=RENDER_CACHE_SIZE, typed=True)
+    def render(temp, humidity) -> str:
+        return f'Погода: {"+" if temp > 0 else ""}{temp}, humidity={humidity}%'
 
 
 class ScreenAvgDisplay(StatisticDisplay):
+    """horizon - период в секундах, за который показывается статистика из reading_store станции, если он есть"""
+    __slots__ = ('horizon',)
+
+    def __init__(self, subject, window_size: int = None, window_period: float = None, horizon: float = None):
+        self.horizon = horizon
+        super().__init__(subject, window_size=window_size, window_period=window_period)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=RENDER_CACHE_SIZE, typed=True)
+    def render_stats(temps: tuple, humiditys: tuple, horizon: float = None) -> str:
+        """temps, humiditys - (min, avg, max), avg округлено до целого, чтобы повторялось в кэше"""
+        title = 'Weather AVG' if horizon is None else f'Weather AVG {horizon:g}s'
+        return f'{title}: ' + ' '.join(f'{low:g}/{avg:.0f}/{high:g}' for low, avg, high in (temps, humiditys))
 
     def show(self):
-        print(f'Weather AVG: {self.avg_temps()} {self.avg_humiditys()}')
+        store = self._subject.reading_store
+        if self.horizon is None or store is None:
+            temps = (self.min_temp(), self.avg_temp(), self.max_temp())
+            humiditys = (self.min_humidity(), self.avg_humidity(), self.max_humidity())
+            horizon = None
+        else:
+            now = time.time()
+            if (stats := store.get_stats(now - self.horizon, now)) is None:
+                self._subject.sink.write('Weather AVG: no data')
+                return
+            temps, humiditys, horizon = stats['TEMP'], stats['HUMIDITY'], self.horizon
+        temps, humiditys = ((low, round(avg, 0), high) for low, avg, high in (temps, humiditys))
+        self._subject.sink.write(self.render_stats(temps, humiditys, horizon))
 
 
 def add_observers(weather_station_):
@@ -183,7 +1241,7 @@ async def update_weather(weather_station_):
 
     await asyncio.sleep(3)
     weather_station_.set_changed()
-    weather_station_.notify_observers(data={'TEMP': 15, 'HUMIDITY': 25})
+    await weather_station_.anotify_observers(data={'TEMP': 15, 'HUMIDITY': 25}, timeout=1)
 
     await asyncio.sleep(3)
     weather_station_.set_changed()
@@ -195,7 +1253,32 @@ async def update_weather(weather_station_):
     await asyncio.wait(tasks)
 
 
+async def stream_weather(weather_station_, observers_):
+    for observer in observers_:
+        weather_station_.attach_channel(observer, maxsize=2, policy=OverflowPolicy.LATEST)
+    for temp in range(10):
+        await weather_station_.publish(data={'TEMP': temp, 'HUMIDITY': 50})
+    print(list(weather_station_.get_channel_stats().values()))
+    for observer in observers_:
+        await weather_station_.detach_channel(observer)
+
+
+def store_weather(path):
+    for _ in range(2):
+        with ReadingStore(path) as store:
+            weather_station_ = WeatherStation()
+            weather_station_.reading_store = store
+            display = ScreenAvgDisplay(weather_station_, horizon=24 * 3600)
+            for temp in range(10):
+                weather_station_.set_weather_data(temp=temp, humidity=50)
+            display.show()
+
+
 if __name__ == '__main__':
     weather_station = WeatherStation()
     observers = add_observers(weather_station)
     asyncio.run(update_weather(weather_station))
+    asyncio.run(stream_weather(weather_station, observers))
+    weather_station.close()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store_weather(os.path.join(tmp_dir, 'readings.bin'))